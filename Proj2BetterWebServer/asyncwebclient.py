@@ -0,0 +1,307 @@
+import sys
+import os
+import time
+import asyncio
+import argparse
+from webclient import buildHttpReq
+
+# Size of the pieces a body is read in, so a big body never has to be
+# held in memory when it is being written to a file
+CHUNK_SIZE = 65536
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="asyncwebclient.py")
+    parser.add_argument("address")
+    parser.add_argument("port", nargs="?", type=int, default=80)
+    parser.add_argument("paths", nargs="*", default=[],
+                        help="paths to fetch, e.g. file1.txt")
+    parser.add_argument("--paths-file",
+                        help="file with one path to fetch per line")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="most connections open to the server at once")
+    parser.add_argument("--out",
+                        help="directory to stream response bodies into")
+    return parser.parse_args(argv[1:])
+
+class Response:
+    '''
+    A parsed response. headers has lowercase names. body is a bytearray, or
+    None when the body was streamed to a file instead.
+    '''
+    def __init__(self, status, headers, body, length):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.length = length
+
+async def readHeaders(reader):
+    '''
+    Reads the status line and headers of a response. Returns the protocol,
+    status code and a dict of headers.
+    '''
+    statusLine = await reader.readline()
+    if not statusLine:
+        raise ConnectionError("server closed the connection")
+    parts = statusLine.decode("ISO-8859-1").split(None, 2)
+    if len(parts) < 2:
+        raise ConnectionError(f"bad status line {statusLine!r}")
+    protocol = parts[0]
+    status = int(parts[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode("ISO-8859-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return protocol, status, headers
+
+async def readExactly(reader, count, write):
+    '''
+    Passes the next count bytes of the stream to write, in pieces of at most
+    CHUNK_SIZE bytes
+    '''
+    while count > 0:
+        data = await reader.readexactly(min(count, CHUNK_SIZE))
+        write(data)
+        count -= len(data)
+
+async def readChunked(reader, write):
+    '''
+    Decodes a Transfer-Encoding: chunked body. Returns the decoded length.
+    '''
+    length = 0
+    while True:
+        sizeLine = await reader.readline()
+        size = int(sizeLine.split(b';')[0], 16)
+        if size == 0:
+            break
+        await readExactly(reader, size, write)
+        length += size
+        # Every chunk ends with a CRLF
+        await reader.readexactly(2)
+    # Skip any trailers up to the final blank line
+    while await reader.readline() not in (b'\r\n', b'\n', b''):
+        pass
+    return length
+
+async def readResponse(reader, sink=None):
+    '''
+    Reads one response from the stream. The body is sized from
+    Content-Length or chunked encoding, and only read to EOF when the server
+    gives neither. It is collected into a bytearray, or written to sink (a
+    binary file object) if one is given.
+
+    Returns the Response and whether the connection can be reused.
+    '''
+    protocol, status, headers = await readHeaders(reader)
+    return await readBody(reader, protocol, status, headers, sink)
+
+async def readBody(reader, protocol, status, headers, sink=None):
+    '''
+    The rest of readResponse() once readHeaders() has been read
+    '''
+    if sink is None:
+        body = bytearray()
+        write = body.extend
+    else:
+        body = None
+        write = sink.write
+
+    connection = headers.get("connection", "").lower()
+    if protocol == "HTTP/1.1":
+        reusable = "close" not in connection
+    else:
+        reusable = "keep-alive" in connection
+
+    if status < 200 or status in (204, 304):
+        # These never have a body
+        length = 0
+    elif "chunked" in headers.get("transfer-encoding", "").lower():
+        length = await readChunked(reader, write)
+    elif "content-length" in headers:
+        length = int(headers["content-length"])
+        await readExactly(reader, length, write)
+    else:
+        # Body runs until the server hangs up
+        length = 0
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            write(data)
+            length += len(data)
+        reusable = False
+
+    return Response(status, headers, body, length), reusable
+
+class HostPool:
+    '''
+    Keep-alive connections to one server. At most maxConnections are open
+    at once, and connections go back to the idle list after each response
+    so later requests skip the TCP handshake.
+    '''
+    def __init__(self, address, port, maxConnections):
+        self.address = address
+        self.port = port
+        self.idle = []
+        self.slots = asyncio.Semaphore(maxConnections)
+
+    async def connect(self):
+        return await asyncio.open_connection(self.address, self.port)
+
+    def takeIdle(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def fetch(self, path, outPath=None):
+        '''
+        Fetches one path over a pooled connection. With outPath the body is
+        streamed into that file, which is only opened once a connection slot
+        is free, so no more files are open than connections. A failed fetch
+        removes the partial file.
+        '''
+        request = buildHttpReq(path.lstrip("/"), self.address, keepAlive=True)
+        requestBytes = request.encode("ISO-8859-1")
+
+        async with self.slots:
+            if outPath is None:
+                return await self.exchange(requestBytes)
+            try:
+                with open(outPath, 'wb') as sink:
+                    return await self.exchange(requestBytes, sink)
+            except BaseException:
+                try:
+                    os.remove(outPath)
+                except OSError:
+                    pass
+                raise
+
+    async def exchange(self, requestBytes, sink=None):
+        '''
+        Sends one request and reads its response, holding a slot. If a
+        reused connection turns out to have been closed by the server, the
+        request is retried once on a fresh one. That is only done when the
+        failure comes before the body starts, since part of the body may
+        already be in sink.
+        '''
+        conn = self.takeIdle()
+        reused = conn is not None
+        if conn is None:
+            conn = await self.connect()
+        while True:
+            reader, writer = conn
+            try:
+                writer.write(requestBytes)
+                await writer.drain()
+                protocol, status, headers = await readHeaders(reader)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                reused = False
+                conn = await self.connect()
+            except Exception:
+                writer.close()
+                raise
+
+        try:
+            response, reusable = await readBody(reader, protocol, status, headers, sink)
+        except Exception:
+            writer.close()
+            raise
+
+        if reusable:
+            self.idle.append(conn)
+        else:
+            writer.close()
+        return response
+
+    async def close(self):
+        for reader, writer in self.idle:
+            writer.close()
+            await writer.wait_closed()
+        self.idle = []
+
+class ClientPool:
+    '''
+    One HostPool per (address, port), so a client talking to several
+    servers keeps separate keep-alive connections to each
+    '''
+    def __init__(self, maxConnectionsPerHost=16):
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self.hosts = {}
+
+    def host(self, address, port):
+        key = (address, port)
+        if key not in self.hosts:
+            self.hosts[key] = HostPool(address, port, self.maxConnectionsPerHost)
+        return self.hosts[key]
+
+    async def fetch(self, address, port, path, outPath=None):
+        return await self.host(address, port).fetch(path, outPath)
+
+    async def close(self):
+        for pool in self.hosts.values():
+            await pool.close()
+
+def outputPath(outDir, path):
+    name = path.strip("/").replace("/", "_") or "index"
+    return os.path.join(outDir, name)
+
+async def fetchOne(pool, address, port, path, outDir):
+    try:
+        outPath = None if outDir is None else outputPath(outDir, path)
+        return path, await pool.fetch(address, port, path, outPath)
+    except (OSError, ValueError, asyncio.IncompleteReadError) as error:
+        return path, error
+
+async def fetchAll(address, port, paths, concurrency=16, outDir=None):
+    '''
+    Fetches every path from one server concurrently over at most
+    concurrency keep-alive connections. Returns a list of (path, Response)
+    pairs in the order given, with the exception in place of the Response
+    for paths that failed.
+    '''
+    pool = ClientPool(concurrency)
+    try:
+        tasks = [fetchOne(pool, address, port, path, outDir) for path in paths]
+        return await asyncio.gather(*tasks)
+    finally:
+        await pool.close()
+
+def readPaths(args):
+    paths = list(args.paths)
+    if args.paths_file:
+        with open(args.paths_file) as fp:
+            paths += [line.strip() for line in fp if line.strip()]
+    return paths or [""]
+
+def main():
+    args = parseArgs(sys.argv)
+    paths = readPaths(args)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    start = time.perf_counter()
+    results = asyncio.run(fetchAll(args.address, args.port, paths,
+                                   args.concurrency, args.out))
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for path, result in results:
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"ERR  /{path.lstrip('/')}: {result}")
+        else:
+            print(f"{result.status}  /{path.lstrip('/')}: {result.length} bytes")
+    print(f"Fetched {len(results) - failed}/{len(results)} paths in {elapsed:.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import sys
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from webclient import buildHttpReq
+from asyncwebclient import readResponse
+
+# Example usage, comparing server modes on localhost:
+#
+# python loadtest.py --spawn select --root .. --connections 64 --duration 10
+# python loadtest.py localhost 28333 --requests 100000 --close
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="loadtest.py")
+    parser.add_argument("address", nargs="?", default="127.0.0.1")
+    parser.add_argument("port", nargs="?", type=int, default=28333)
+    parser.add_argument("--path", action="append",
+                        help="path to request, repeat to cycle through several "
+                             "(default file1.txt)")
+    parser.add_argument("--connections", type=int, default=16,
+                        help="number of concurrent connections")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds to run for when --requests isn't given")
+    parser.add_argument("--requests", type=int,
+                        help="stop after this many requests instead of a duration")
+    parser.add_argument("--close", action="store_true",
+                        help="open a new connection for every request")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="seconds before a request counts as an error")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    parser.add_argument("--spawn", choices=("single", "select", "pool"),
+                        help="start webserver.py in this mode on a free local "
+                             "port and benchmark it")
+    parser.add_argument("--root", default=".",
+                        help="directory the spawned server serves files from")
+    return parser.parse_args(argv[1:])
+
+class Stats:
+    '''
+    Results gathered by every connection of one run
+    '''
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.bytes = 0
+        self.connects = 0
+        self.started = 0
+
+def percentile(sortedValues, pct):
+    '''
+    Nearest-rank percentile of an already sorted list
+    '''
+    if not sortedValues:
+        return 0.0
+    rank = max(int(len(sortedValues) * pct / 100 + 0.5), 1)
+    return sortedValues[min(rank, len(sortedValues)) - 1]
+
+async def worker(args, requests, stats, deadline):
+    '''
+    Issues requests back to back on one connection (or a fresh connection
+    per request in --close mode) until the deadline passes or the shared
+    request budget runs out
+    '''
+    keepAlive = not args.close
+    conn = None
+    while time.perf_counter() < deadline:
+        if args.requests is not None:
+            if stats.started >= args.requests:
+                break
+        request = requests[stats.started % len(requests)]
+        stats.started += 1
+
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await asyncio.wait_for(
+                    asyncio.open_connection(args.address, args.port), args.timeout)
+                stats.connects += 1
+            reader, writer = conn
+            writer.write(request)
+            await writer.drain()
+            response, reusable = await asyncio.wait_for(readResponse(reader), args.timeout)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats.errors += 1
+            if conn is not None:
+                conn[1].close()
+            conn = None
+            continue
+        stats.latencies.append(time.perf_counter() - start)
+        stats.statuses[response.status] = stats.statuses.get(response.status, 0) + 1
+        stats.bytes += response.length
+
+        if not (keepAlive and reusable):
+            writer.close()
+            conn = None
+    if conn is not None:
+        conn[1].close()
+
+async def runLoad(args):
+    paths = args.path or ["file1.txt"]
+    requests = [buildHttpReq(path.lstrip("/"), args.address, not args.close)
+                .encode("ISO-8859-1") for path in paths]
+
+    stats = Stats()
+    if args.requests is not None:
+        deadline = float("inf")
+    else:
+        deadline = time.perf_counter() + args.duration
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(args, requests, stats, deadline)
+                           for _ in range(args.connections)))
+    elapsed = time.perf_counter() - start
+    return stats, elapsed
+
+def ms(seconds):
+    return round(seconds * 1000, 3)
+
+def buildReport(args, stats, elapsed):
+    latencies = sorted(stats.latencies)
+    completed = len(latencies)
+    return {
+        "target": f"{args.address}:{args.port}",
+        "server_mode": args.spawn,
+        "mode": "close" if args.close else "keep-alive",
+        "connections": args.connections,
+        "elapsed_s": round(elapsed, 3),
+        "requests": completed,
+        "errors": stats.errors,
+        "connects": stats.connects,
+        "statuses": {str(code): count for code, count in sorted(stats.statuses.items())},
+        "requests_per_s": round(completed / elapsed, 1) if elapsed else 0.0,
+        "mb_per_s": round(stats.bytes / elapsed / 1e6, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1]) if latencies else 0.0,
+        },
+    }
+
+def printReport(report):
+    latency = report["latency_ms"]
+    server = f" ({report['server_mode']} server)" if report["server_mode"] else ""
+    print(f"Target:      {report['target']}{server}")
+    print(f"Mode:        {report['mode']}, {report['connections']} connections")
+    print(f"Requests:    {report['requests']} in {report['elapsed_s']}s, "
+          f"{report['errors']} errors, {report['connects']} connects")
+    print(f"Statuses:    {report['statuses']}")
+    print(f"Throughput:  {report['requests_per_s']} req/s, {report['mb_per_s']} MB/s")
+    print(f"Latency ms:  p50 {latency['p50']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  max {latency['max']}")
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawnServer(args):
+    '''
+    Starts webserver.py in the requested mode and waits until it accepts
+    connections. Points args at it and returns the process.
+    '''
+    args.address = "127.0.0.1"
+    args.port = freePort()
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "webserver.py")
+    proc = subprocess.Popen([sys.executable, server, str(args.port), "--mode", args.spawn],
+                            cwd=args.root, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((args.address, args.port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    print("Spawned server never started listening", file=sys.stderr)
+    sys.exit(1)
+
+def main():
+    args = parseArgs(sys.argv)
+
+    proc = spawnServer(args) if args.spawn else None
+    try:
+        stats, elapsed = asyncio.run(runLoad(args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    report = buildReport(args, stats, elapsed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        printReport(report)
+    return 1 if stats.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+class CacheEntry:
+    '''
+    One cached response along with the file version it was built from
+    '''
+    def __init__(self, path, version, data):
+        self.path = path
+        self.version = version
+        self.data = data
+        self.checked = time.monotonic()
+
+def fileVersion(stat):
+    '''
+    Returns the (mtime, size) pair used to tell whether a file has changed
+    '''
+    return stat.st_mtime_ns, stat.st_size
+
+class ResponseCache:
+    '''
+    LRU cache of encoded bytes built from files (whole responses, or
+    compressed bodies) under a total byte budget.
+
+    Each entry remembers the mtime and size of the file it came from. The
+    file is only stat()ed again once checkInterval seconds have passed since
+    the last check, so hot files are served without touching the filesystem
+    while edits still show up within checkInterval seconds.
+    '''
+    def __init__(self, maxBytes, checkInterval=1.0):
+        self.maxBytes = maxBytes
+        self.checkInterval = checkInterval
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the CacheEntry for key, or None if it is missing or the file
+        it was built from has changed. The entry's version doubles as the
+        file's validators, so callers can answer conditional requests
+        without a stat() of their own.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            if now - entry.checked >= self.checkInterval:
+                if not self.isFresh(entry):
+                    self.remove(key)
+                    self.misses += 1
+                    return None
+                entry.checked = now
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, path, stat, data):
+        '''
+        Stores data built from path, whose stat() result was taken before the
+        file was read. Responses bigger than the whole budget are not cached.
+        '''
+        if len(data) > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = CacheEntry(path, fileVersion(stat), data)
+            self.size += len(data)
+            # Evict least recently used entries until we fit the budget
+            while self.size > self.maxBytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+
+    def isFresh(self, entry):
+        try:
+            return fileVersion(os.stat(entry.path)) == entry.version
+        except OSError:
+            return False
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.data)
+
+    def stats(self):
+        return (f'cache: {self.hits} hits, {self.misses} misses, '
+                f'{len(self.entries)} entries, {self.size} bytes')
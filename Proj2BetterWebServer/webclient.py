@@ -15,10 +15,11 @@ def parseAddressAndPort(args):
         port = 80
     return address, port
 
-def buildHttpReq(path, address):
+def buildHttpReq(path, address, keepAlive=False):
+    connection = "keep-alive" if keepAlive else "close"
     request = (f'GET /{path} HTTP/1.1\r\n'
                 f'Host: {address}\r\n'
-                'Connection: close\r\n'
+                f'Connection: {connection}\r\n'
                 '\r\n')
     return request
 
@@ -1,19 +1,77 @@
 import socket
 import sys
 import os
+import argparse
+import selectors
+import threading
+import time
+import stat as statmodule
+import gzip
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from responsecache import ResponseCache, fileVersion
 
-def checkNumArgs(argv):
-    # if len(argv) != 1 and len(argv) != 2:
-    if len(argv) not in {1, 2}:
-        print("Incorrect number of arguments")
-        exit(1)
+# Largest request header block we will buffer before giving up on a client
+MAX_HEADER_SIZE = 65536
 
-def parsePort(args):
-    if len(args) > 1:
-        port = int(args[1])
-    else:
-        port = 28333
-    return port
+# Files at least this big are streamed from disk instead of read into
+# memory, and the buffer size used when os.sendfile() can't be used
+streamThreshold = 1024 * 1024
+CHUNK_SIZE = 65536
+
+# Seconds to back off when accept() fails, e.g. out of file descriptors
+ACCEPT_RETRY_DELAY = 0.1
+
+# Idle keep-alive timeout in seconds, seconds a response may go without
+# the client taking any of it, and requests allowed per connection,
+# overridden from the command line in main()
+keepAliveTimeout = 5.0
+writeTimeout = 30.0
+maxRequests = 100
+
+# Text bodies smaller than this are not worth compressing, None turns
+# compression off
+compressMinSize = 256
+
+# Encoded 200 responses keyed by (file name, keep-alive, content coding)
+# and compressed bodies keyed by (file name, content coding), both replaced
+# in main()
+responseCache = ResponseCache(64 * 1024 * 1024)
+compressedCache = ResponseCache(16 * 1024 * 1024)
+
+extDict = {
+    ".txt": "text/plain",
+    ".html": "text/html"
+}
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="webserver.py")
+    parser.add_argument("port", nargs="?", type=int, default=28333)
+    # single: one connection at a time, select: event loop, pool: worker threads
+    parser.add_argument("--mode", choices=("single", "select", "pool"),
+                        default="single")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of worker threads in pool mode")
+    parser.add_argument("--keepalive-timeout", type=float, default=5.0,
+                        help="seconds an idle persistent connection stays open")
+    parser.add_argument("--write-timeout", type=float, default=30.0,
+                        help="seconds a client may stop reading a response before "
+                             "it is dropped (select mode)")
+    parser.add_argument("--max-requests", type=int, default=100,
+                        help="requests served on one connection before closing")
+    parser.add_argument("--cache-bytes", type=int, default=64 * 1024 * 1024,
+                        help="response cache budget in bytes, 0 to disable")
+    parser.add_argument("--cache-check-interval", type=float, default=1.0,
+                        help="seconds between checks of a cached file for changes")
+    parser.add_argument("--compress-min-size", type=int, default=256,
+                        help="smallest text body that is gzip/deflate compressed")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="never compress responses")
+    parser.add_argument("--stream-threshold", type=int, default=1024 * 1024,
+                        help="files of at least this many bytes are sent with sendfile")
+    return parser.parse_args(argv[1:])
 
 def bindSocket(sock, port):
     # Error handling for bind is from geeksforgeeks.org
@@ -25,38 +83,84 @@ def bindSocket(sock, port):
             + message[1])
         exit(1)
 
-def receiveRequest(sock):
-    request_data = b''
+def requestEnd(buffer):
+    '''
+    Returns the offset just past the first complete request in buffer
+    (header block plus any Content-Length body), or -1 if the buffer does
+    not hold a whole request yet
+    '''
+    headerEnd = buffer.find(b'\r\n\r\n')
+    if headerEnd < 0:
+        return -1
+    end = headerEnd + 4
+    for line in bytes(buffer[:headerEnd]).split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            # Anything but plain digits (a negative length, say) is left to
+            # parseRequest() to reject, without reading a body for it
+            value = value.strip()
+            if value.isdigit():
+                end += int(value)
+            break
+    if len(buffer) < end:
+        return -1
+    return end
 
+def receiveRequest(sock, buffer):
+    '''
+    Receives into buffer until it holds at least one complete request.
+    Returns False if the client hung up, went idle past the socket timeout,
+    or sent an oversized header.
+    '''
     # receive data in loop until blank line reached (\r\n\r\n)
-    while True:
-        data = sock.recv(4096)
-        # print(f'Data: {data}')
+    while requestEnd(buffer) < 0:
+        if len(buffer) > MAX_HEADER_SIZE:
+            return False
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            return False
         if not data:
-            break
-        request_data += data
-
-        #Check for end of request
-        if b'\r\n\r\n' in request_data:
-            break
-    return request_data
+            return False
+        buffer += data
+    return True
 
 def parseRequest(request):
     lines = request.split("\r\n")
-    if not lines:
-        print("No request exists to in parseRequest()")
-        exit(1)
     # Break request into separate parts, header will be at index 0
     firstLine = lines[0]
     firstLineParts = firstLine.split()
     if len(firstLineParts) != 3:
-        print("Request header formatted incorrectly in parseRequest()")
-        exit(1)
+        raise ValueError("Request header formatted incorrectly in parseRequest()")
     # Break request header into 3 parts: the method(GET, POST, etc.), the path, and the protocol (http, etc)
     method = firstLineParts[0]
     path = firstLineParts[1]
     protocol = firstLineParts[2]
-    return method, path, protocol
+
+    # The remaining lines up to the blank line are "Name: value" headers
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = headers.get("content-length")
+    if length is not None and not (length.isascii() and length.isdigit()):
+        raise ValueError("Malformed Content-Length in parseRequest()")
+    return method, path, protocol, headers
+
+def wantsKeepAlive(protocol, headers):
+    '''
+    HTTP/1.1 connections persist unless the client asks to close them,
+    HTTP/1.0 connections only persist if the client asks for keep-alive
+    '''
+    connection = headers.get("connection", "").lower()
+    if "close" in connection:
+        return False
+    if protocol == "HTTP/1.1":
+        return True
+    return "keep-alive" in connection
 
 def getFileName(fullPath):
     pathAndFile = os.path.split(fullPath)
@@ -78,84 +182,608 @@ def getExtension(fileName):
 
 def readFile(fileName):
     try:
-        with open(fileName) as fp:
+        with open(fileName, 'rb') as fp:
             data = fp.read()
             return data
     except:
-        return ""
+        return None
 
-def buildResponse(code, mime, length, body):
-    res = (f'HTTP/1.1 {code}\r\n'
-            f'Content-Type: {mime}\r\n'
-            f'Content-Length: {length}\r\n'
-            'Connection: close\r\n'
-            '\r\n'
-            f'{body}')
-    return res
+def connectionHeader(keepAlive):
+    if keepAlive:
+        return ('Connection: keep-alive\r\n'
+                f'Keep-Alive: timeout={keepAliveTimeout:g}, max={maxRequests}\r\n')
+    return 'Connection: close\r\n'
 
-def main():
-    args = sys.argv
+def buildHeader(code, mime, length, keepAlive=False, extra=()):
+    '''
+    Builds the encoded status line and headers. mime and length may be None
+    to leave those headers out, extra holds any further "Name: value" lines.
+    '''
+    res = f'HTTP/1.1 {code}\r\n'
+    if mime is not None:
+        res += f'Content-Type: {mime}\r\n'
+    if length is not None:
+        res += f'Content-Length: {length}\r\n'
+    for line in extra:
+        res += f'{line}\r\n'
+    res += f'{connectionHeader(keepAlive)}\r\n'
+    return res.encode("ISO-8859-1")
 
-    extDict = {
-        ".txt": "text/plain",
-        ".html": "text/html"
-    }
+def buildResponse(code, mime, length, body, keepAlive=False, extra=()):
+    return buildHeader(code, mime, length, keepAlive, extra) + body
 
-    checkNumArgs(args)
+def makeETag(version, encoding=None):
+    '''
+    Builds a strong entity tag from a file's (mtime, size) version. Each
+    content coding is a different representation, so it gets its own tag.
+    '''
+    mtime, size = version
+    if encoding is not None:
+        return f'"{mtime:x}-{size:x}-{encoding}"'
+    return f'"{mtime:x}-{size:x}"'
 
-    port = parsePort(args)
+def validatorHeaders(etag, lastModified):
+    return [f'ETag: {etag}', f'Last-Modified: {lastModified}', 'Accept-Ranges: bytes']
 
-    # Get a socket
-    s = socket.socket()
+def acceptedEncoding(acceptEncoding):
+    '''
+    Picks gzip or deflate from an Accept-Encoding header, honouring q-values
+    (q=0 refuses a coding) and preferring gzip on a tie. Returns None when
+    the body should be sent as is.
+    '''
+    if not acceptEncoding:
+        return None
+    weights = {}
+    for item in acceptEncoding.split(","):
+        coding, *params = item.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.strip().lower()] = q
+    best = None
+    bestQ = 0.0
+    for coding in ("gzip", "deflate"):
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > bestQ:
+            best = coding
+            bestQ = q
+    return best
 
-    # Bind the socket to a port: bind()
-    bindSocket(s, port)
+def compressBody(data, encoding):
+    if encoding == "gzip":
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    # HTTP's "deflate" is the zlib format, not raw deflate
+    return zlib.compress(data, 6)
 
-    # Set the socket up to listen: listen()
-    s.listen()
-    print(f"Server listening on port {port}")
+def sidecarStat(fileName, stat):
+    '''
+    Returns the stat() of a precompressed fileName.gz next to the file, or
+    None if there isn't one at least as new as the file itself
+    '''
+    try:
+        sidecar = os.stat(fileName + ".gz")
+    except OSError:
+        return None
+    if not statmodule.S_ISREG(sidecar.st_mode) or sidecar.st_mtime_ns < stat.st_mtime_ns:
+        return None
+    return sidecar
 
-    # Accept new connections (returns a tuple)
-    while True:
-        newConn, address = s.accept()
-        # print(f'New Socket: {new_conn}, Address: {address}')
-        newSocket = newConn
+def compressedBody(fileName, stat, data, encoding):
+    '''
+    Returns data compressed with encoding, paying for the compression once
+    per file version. A fresh fileName.gz sidecar is used as is for gzip.
+    '''
+    key = (fileName, encoding)
+    cached = compressedCache.get(key)
+    if cached is not None and cached.version == fileVersion(stat):
+        return cached.data
 
-        # Receive the request from client in loop
-        requestData = receiveRequest(newSocket)
+    body = None
+    if encoding == "gzip" and sidecarStat(fileName, stat) is not None:
+        body = readFile(fileName + ".gz")
+    if body is None:
+        body = compressBody(data, encoding)
+    compressedCache.put(key, fileName, stat, body)
+    return body
 
-        # Convert data into bytes
-        requestBytes = requestData.decode("ISO-8859-1")
+def notModified(headers, etag, mtime):
+    '''
+    Returns True if the client's cached copy is still current. As HTTP
+    requires, If-None-Match wins over If-Modified-Since when both are sent.
+    '''
+    ifNoneMatch = headers.get("if-none-match")
+    if ifNoneMatch is not None:
+        if ifNoneMatch.strip() == "*":
+            return True
+        # GET uses weak comparison, so W/ prefixes are ignored
+        tags = [tag.strip().removeprefix("W/") for tag in ifNoneMatch.split(",")]
+        return etag in tags
 
-        # Parse the request, splitting off the method, path and protocol
-        method, path, protocol = parseRequest(requestBytes)
+    ifModifiedSince = headers.get("if-modified-since")
+    if ifModifiedSince is not None:
+        try:
+            since = parsedate_to_datetime(ifModifiedSince).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified only has one second resolution
+        return int(mtime) <= since
+    return False
 
-        # Parse the path plus filename, splitting them from eachother
-        pathOnly, fileName = getFileName(path)
+def parseRange(rangeHeader, size):
+    '''
+    Turns a Range header into an inclusive (start, end) byte range of a
+    file of the given size. Returns None if the header should be ignored
+    (bad syntax or several ranges, which we answer with the whole file) and
+    raises ValueError if the range lies past the end of the file.
+    '''
+    unit, _, spec = rangeHeader.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+    if first == "":
+        # Suffix range: the final N bytes
+        if last == "":
+            return None
+        count = int(last)
+        if count == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(size - count, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and start > end:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
 
-        #Parse the filename, splitting off the extension
-        nameOnly, extension = getExtension(fileName)
+class FileSegment:
+    '''
+    A byte range of a file that is streamed to the client after the
+    headers rather than read into memory. offset and count advance as the
+    event loop sends it piece by piece.
+    '''
+    def __init__(self, path, offset, count):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.fp = None
 
-        # Read the file in
-        data = readFile(fileName)
+    def __len__(self):
+        return self.count
 
-        if len(data) == 0:
-            res = buildResponse("404 Not Found", "text/plain", "13", "404 not found")
+def sendParts(sock, parts):
+    '''
+    Writes response parts to a blocking socket. Runs of bytes are joined
+    into one sendall(), file segments go through socket.sendfile() which
+    uses os.sendfile() where available and a buffered copy elsewhere.
+    '''
+    pending = []
+    for part in parts:
+        if isinstance(part, FileSegment):
+            sock.sendall(b''.join(pending))
+            pending = []
+            with open(part.path, 'rb') as fp:
+                sent = sock.sendfile(fp, part.offset, part.count)
+            if sent < part.count:
+                # The file shrank under us, the promised length can't be met
+                raise OSError("short sendfile")
         else:
-            # Build the response
-            res = buildResponse("200 OK", extDict[extension], len(data), data)
-        
-        # Encode the response
-        bytes = res.encode("ISO-8859-1")
-        # print(f'Bytes: {bytes}')
-        
-        # Send the response
-        newSocket.sendall(bytes)
+            pending.append(part)
+    sock.sendall(b''.join(pending))
+
+def handleRequest(requestData, served=0):
+    '''
+    Takes the raw bytes of one request and the number of requests already
+    served on this connection. Returns the response as a list of parts
+    (bytes, or FileSegment for a streamed body) and whether the connection
+    stays open afterwards.
+    '''
+    # Convert data into bytes
+    requestBytes = requestData.decode("ISO-8859-1")
+
+    # Parse the request, splitting off the method, path, protocol and headers
+    try:
+        method, path, protocol, headers = parseRequest(requestBytes)
+    except ValueError:
+        res = buildResponse("400 Bad Request", "text/plain", 15, b"400 bad request")
+        return [res], False
+
+    keepAlive = wantsKeepAlive(protocol, headers) and served + 1 < maxRequests
+
+    # Parse the path plus filename, splitting them from eachother
+    pathOnly, fileName = getFileName(path)
+
+    #Parse the filename, splitting off the extension
+    nameOnly, extension = getExtension(fileName)
+
+    mime = extDict.get(extension, "application/octet-stream")
+
+    # Only text is worth compressing, and ranges always address the
+    # uncompressed bytes
+    compressible = compressMinSize is not None and mime.startswith("text/")
+    wanted = None
+    if compressible and "range" not in headers:
+        wanted = acceptedEncoding(headers.get("accept-encoding"))
+
+    # A cached response carries the file version, otherwise stat() it.
+    # Note the version before reading so a concurrent edit invalidates
+    # what we cache.
+    cacheKey = (fileName, keepAlive, wanted)
+    cached = responseCache.get(cacheKey)
+    stat = None
+    if cached is not None:
+        version = cached.version
+    else:
+        try:
+            stat = os.stat(fileName)
+        except (OSError, ValueError):
+            # ValueError for paths os.stat() refuses, e.g. an embedded NUL
+            stat = None
+        if stat is None or not statmodule.S_ISREG(stat.st_mode):
+            res = buildResponse("404 Not Found", "text/plain", 13, b"404 not found", keepAlive)
+            return [res], keepAlive
+        version = fileVersion(stat)
+
+    mtimeNs, size = version
+    mtime = mtimeNs / 1e9
+
+    # Small bodies go out as they are. Big files are never compressed on
+    # the fly, but a precompressed .gz sidecar can still be streamed.
+    encoding = wanted
+    sidecar = None
+    if encoding is not None and size < compressMinSize:
+        encoding = None
+    elif encoding is not None and size >= streamThreshold and cached is None:
+        if encoding == "gzip":
+            sidecar = sidecarStat(fileName, stat)
+        if sidecar is None:
+            encoding = None
+
+    etag = makeETag(version, encoding)
+    lastModified = formatdate(mtime, usegmt=True)
+    validators = validatorHeaders(etag, lastModified)
+    if compressible:
+        validators.append('Vary: Accept-Encoding')
+    if encoding is not None:
+        validators.append(f'Content-Encoding: {encoding}')
+
+    # Conditional GET: the client's copy is current, send headers only
+    if notModified(headers, etag, mtime):
+        header = buildHeader("304 Not Modified", None, None, keepAlive, validators)
+        return [header], keepAlive
+
+    # Range request: stream just the requested bytes from disk. If-Range
+    # only lets the range through if the file is still the version the
+    # client has.
+    rangeHeader = headers.get("range")
+    ifRange = headers.get("if-range")
+    if rangeHeader is not None and ifRange in (None, etag, lastModified):
+        try:
+            byteRange = parseRange(rangeHeader, size)
+        except ValueError:
+            res = buildResponse("416 Range Not Satisfiable", "text/plain", 0, b"",
+                                keepAlive, [f'Content-Range: bytes */{size}'])
+            return [res], keepAlive
+        if byteRange is not None:
+            start, end = byteRange
+            extra = validators + [f'Content-Range: bytes {start}-{end}/{size}']
+            header = buildHeader("206 Partial Content", mime, end - start + 1,
+                                 keepAlive, extra)
+            return [header, FileSegment(fileName, start, end - start + 1)], keepAlive
+
+    # Serve straight from the cache if this file was answered recently
+    if cached is not None:
+        return [cached.data], keepAlive
 
+    # Big files are streamed straight from disk after the headers
+    if size >= streamThreshold:
+        if sidecar is not None:
+            header = buildHeader("200 OK", mime, sidecar.st_size, keepAlive, validators)
+            return [header, FileSegment(fileName + ".gz", 0, sidecar.st_size)], keepAlive
+        header = buildHeader("200 OK", mime, size, keepAlive, validators)
+        return [header, FileSegment(fileName, 0, size)], keepAlive
+
+    # Read the file in
+    data = readFile(fileName)
+    if data is None:
+        res = buildResponse("404 Not Found", "text/plain", 13, b"404 not found", keepAlive)
+        return [res], keepAlive
+    if encoding is not None:
+        data = compressedBody(fileName, stat, data, encoding)
+
+    # Build the response
+    response = buildResponse("200 OK", mime, len(data), data, keepAlive, validators)
+    responseCache.put(cacheKey, fileName, stat, response)
+    return [response], keepAlive
+
+def processBuffer(buffer, served):
+    '''
+    Answers every complete request at the front of buffer, in order, and
+    removes them from it. Returns the response parts, the new served count and
+    whether the connection must be closed once they have been sent.
+    '''
+    responses = []
+    while True:
+        end = requestEnd(buffer)
+        if end < 0:
+            return responses, served, False
+        requestData = bytes(buffer[:end])
+        del buffer[:end]
+        parts, keepAlive = handleRequest(requestData, served)
+        responses.extend(parts)
+        served += 1
+        if not keepAlive:
+            # Anything pipelined after a closing request is dropped
+            buffer.clear()
+            return responses, served, True
+
+def handleConnection(sock):
+    '''
+    Serves requests on a blocking socket until the client closes, goes
+    idle, or uses up its request budget, then closes it
+    '''
+    sock.settimeout(keepAliveTimeout)
+    buffer = bytearray()
+    served = 0
+    try:
+        # Receive requests from client in loop
+        while receiveRequest(sock, buffer):
+            try:
+                responses, served, closeAfter = processBuffer(buffer, served)
+            except Exception:
+                # A request we failed on only costs its own connection
+                break
+            # Send pipelined responses back in order
+            sendParts(sock, responses)
+            if closeAfter:
+                break
+    except OSError:
+        pass
+    finally:
         # Close the new socket
-        newSocket.close()
-    # End loop
+        sock.close()
+
+def serveSingle(s):
+    '''
+    Baseline mode: accept and fully serve one connection at a time
+    '''
+    while True:
+        try:
+            newSocket, address = s.accept()
+        except OSError:
+            time.sleep(ACCEPT_RETRY_DELAY)
+            continue
+        handleConnection(newSocket)
+
+def servePool(s, workers):
+    '''
+    Hands each accepted connection to a bounded pool of worker threads.
+    Accepting blocks while every worker is busy and the backlog is full,
+    so the kernel listen queue absorbs bursts instead of our memory.
+    '''
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def work(sock):
+        try:
+            handleConnection(sock)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            slots.acquire()
+            try:
+                newSocket, address = s.accept()
+            except OSError:
+                # Out of file descriptors or the like, give the slot back
+                # and let the workers close some connections first
+                slots.release()
+                time.sleep(ACCEPT_RETRY_DELAY)
+                continue
+            pool.submit(work, newSocket)
+
+class Connection:
+    '''
+    Per-connection state for the event loop: bytes received so far, the
+    queue of responses still waiting to be written, and keep-alive
+    bookkeeping
+    '''
+    def __init__(self, sock):
+        self.sock = sock
+        self.inBuffer = bytearray()
+        self.outQueue = deque()
+        self.sent = 0
+        self.served = 0
+        self.closeAfter = False
+        self.lastActive = time.monotonic()
+
+def closeConnection(sel, conn):
+    sel.unregister(conn.sock)
+    conn.sock.close()
+    for part in conn.outQueue:
+        if isinstance(part, FileSegment) and part.fp is not None:
+            part.fp.close()
+
+def closeIdleConnections(sel):
+    '''
+    Drops keep-alive connections idle for longer than keepAliveTimeout, and
+    connections whose client stopped reading a response for longer than
+    writeTimeout, which also closes any file being streamed to them
+    '''
+    now = time.monotonic()
+    for key in list(sel.get_map().values()):
+        conn = key.data
+        if conn is None:
+            continue
+        timeout = writeTimeout if conn.outQueue else keepAliveTimeout
+        if now - conn.lastActive > timeout:
+            closeConnection(sel, conn)
+
+def onReadable(sel, conn):
+    try:
+        data = conn.sock.recv(4096)
+    except BlockingIOError:
+        return
+    except OSError:
+        data = b''
+    if not data:
+        closeConnection(sel, conn)
+        return
+    conn.inBuffer += data
+    conn.lastActive = time.monotonic()
+
+    try:
+        responses, conn.served, conn.closeAfter = processBuffer(conn.inBuffer, conn.served)
+    except Exception:
+        # A request we failed on only costs its own connection
+        closeConnection(sel, conn)
+        return
+    if responses:
+        conn.outQueue.extend(responses)
+        sel.modify(conn.sock, selectors.EVENT_WRITE, conn)
+    elif len(conn.inBuffer) > MAX_HEADER_SIZE:
+        closeConnection(sel, conn)
+
+def sendSegment(sock, segment):
+    '''
+    Sends as much of a file segment as a non-blocking socket accepts,
+    advancing the segment. Uses os.sendfile() so the data never enters
+    user space, or a fixed-size buffer where that isn't available.
+    '''
+    if segment.fp is None:
+        segment.fp = open(segment.path, 'rb')
+    if hasattr(os, "sendfile"):
+        sent = os.sendfile(sock.fileno(), segment.fp.fileno(),
+                           segment.offset, segment.count)
+    else:
+        segment.fp.seek(segment.offset)
+        chunk = segment.fp.read(min(CHUNK_SIZE, segment.count))
+        sent = sock.send(chunk) if chunk else 0
+    if sent == 0:
+        # The file shrank under us, the promised length can't be met
+        raise OSError("short sendfile")
+    segment.offset += sent
+    segment.count -= sent
+    if segment.count == 0:
+        segment.fp.close()
+        segment.fp = None
+
+def onWritable(sel, conn):
+    part = conn.outQueue[0]
+    try:
+        if isinstance(part, FileSegment):
+            sendSegment(conn.sock, part)
+            done = part.count == 0
+        else:
+            conn.sent += conn.sock.send(memoryview(part)[conn.sent:])
+            done = conn.sent == len(part)
+    except BlockingIOError:
+        return
+    except OSError:
+        closeConnection(sel, conn)
+        return
+    conn.lastActive = time.monotonic()
+    if not done:
+        return
+    conn.outQueue.popleft()
+    conn.sent = 0
+    if conn.outQueue:
+        return
+    if conn.closeAfter:
+        closeConnection(sel, conn)
+    else:
+        # Everything answered, wait for the next request
+        sel.modify(conn.sock, selectors.EVENT_READ, conn)
+
+def serveSelect(s):
+    '''
+    Event loop mode: a single thread multiplexes every connection with
+    non-blocking sockets, so a slow client never stalls the others
+    '''
+    sel = selectors.DefaultSelector()
+    s.setblocking(False)
+    sel.register(s, selectors.EVENT_READ)
+
+    lastSweep = time.monotonic()
+    acceptPausedUntil = None
+    while True:
+        # Wake up at least once a second to drop idle keep-alive connections
+        timeout = 1.0
+        if acceptPausedUntil is not None:
+            wait = acceptPausedUntil - time.monotonic()
+            if wait <= 0:
+                sel.register(s, selectors.EVENT_READ)
+                acceptPausedUntil = None
+            else:
+                timeout = min(timeout, wait)
+
+        for key, events in sel.select(timeout=timeout):
+            if key.fileobj is s:
+                try:
+                    newSocket, address = s.accept()
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    # Out of file descriptors or the like. The connection
+                    # stays pending and select() would keep waking us to
+                    # fail on it again, so stop watching for a moment
+                    sel.unregister(s)
+                    acceptPausedUntil = time.monotonic() + ACCEPT_RETRY_DELAY
+                    continue
+                newSocket.setblocking(False)
+                sel.register(newSocket, selectors.EVENT_READ, Connection(newSocket))
+            elif events & selectors.EVENT_READ:
+                onReadable(sel, key.data)
+            else:
+                onWritable(sel, key.data)
+        if time.monotonic() - lastSweep >= 1.0:
+            closeIdleConnections(sel)
+            lastSweep = time.monotonic()
+
+def main():
+    global keepAliveTimeout, writeTimeout, maxRequests, responseCache, streamThreshold
+    global compressMinSize, compressedCache
+
+    args = parseArgs(sys.argv)
+    keepAliveTimeout = args.keepalive_timeout
+    writeTimeout = args.write_timeout
+    maxRequests = args.max_requests
+    responseCache = ResponseCache(args.cache_bytes, args.cache_check_interval)
+    streamThreshold = args.stream_threshold
+    compressMinSize = None if args.no_compress else args.compress_min_size
+    compressedCache = ResponseCache(args.cache_bytes // 4, args.cache_check_interval)
+
+    port = args.port
+
+    # Get a socket
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    # Bind the socket to a port: bind()
+    bindSocket(s, port)
+
+    # Set the socket up to listen: listen()
+    s.listen(128)
+    print(f"Server listening on port {port} ({args.mode} mode)")
+
+    try:
+        if args.mode == "select":
+            serveSelect(s)
+        elif args.mode == "pool":
+            servePool(s, args.workers)
+        else:
+            serveSingle(s)
+    except KeyboardInterrupt:
+        print(responseCache.stats())
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,6 @@
 import sys
 import socket
+import weakref
 
 # How many bytes is the word length?
 WORD_LEN_SIZE = 2
@@ -7,8 +8,99 @@ WORD_LEN_SIZE = 2
 def usage():
     print("usage: wordclient.py server port", file=sys.stderr)
 
-packet_buffer = b''
+# Bytes asked for per recv(). Big reads keep the number of system calls
+# down on long word streams.
+RECV_SIZE = 65536
 
+class WordPacketDecoder:
+    """
+    Splits a stream of word packets into individual packets.
+
+    Data is received in large chunks into a bytearray and a read offset
+    walks over it, so decoding never re-copies the rest of the buffer per
+    word. Consumed bytes are only dropped once they make up more than half
+    the buffer, which keeps the total work linear in the stream length.
+
+    Each socket gets its own decoder, so any number of streams can be
+    decoded side by side.
+    """
+
+    def __init__(self, sock, recv_size=RECV_SIZE):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.offset = 0
+        self.chunk = bytearray(recv_size)
+        self.chunk_view = memoryview(self.chunk)
+
+    def feed(self, data):
+        """
+        Append received bytes to the buffer.
+        """
+        if self.offset > len(self.buffer) // 2:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def next_buffered_packet(self):
+        """
+        Return the next complete word packet already in the buffer, or
+        None if more data is needed.
+        """
+        buffer = self.buffer
+        offset = self.offset
+        if len(buffer) - offset < WORD_LEN_SIZE:
+            return None
+        packet_size = (buffer[offset] << 8) | buffer[offset + 1]
+        end = offset + WORD_LEN_SIZE + packet_size
+        if len(buffer) < end:
+            return None
+        self.offset = end
+        return bytes(buffer[offset:end])
+
+    def receive(self):
+        """
+        Receive one chunk from the socket into the buffer. Returns False
+        once the server has hung up.
+        """
+        count = self.sock.recv_into(self.chunk)
+        if count == 0:
+            return False
+        self.feed(self.chunk_view[:count])
+        return True
+
+    def next_packet(self):
+        """
+        Return the next word packet, receiving more data as needed. Returns
+        None if there are no more words.
+        """
+        while True:
+            packet = self.next_buffered_packet()
+            if packet is not None:
+                return packet
+            if not self.receive():
+                return None
+
+    def packets(self):
+        """
+        Yield every word packet until the server hangs up.
+        """
+        while True:
+            packet = self.next_buffered_packet()
+            if packet is None:
+                if not self.receive():
+                    return
+                continue
+            yield packet
+
+    def words(self):
+        """
+        Yield every word in the stream as a string.
+        """
+        for packet in self.packets():
+            yield extract_word(packet)
+
+# One decoder per socket, dropped automatically when the socket goes away
+decoders = weakref.WeakKeyDictionary()
 
 def get_next_word_packet(s):
     """
@@ -20,20 +112,10 @@ def get_next_word_packet(s):
     Returns None if there are no more words, i.e. the server has hung
     up.
     """
-    global packet_buffer
-    while True:
-        if len(packet_buffer) >= 2:
-            packet_size = int.from_bytes(packet_buffer[:2], 'big')
-            if len(packet_buffer) >= packet_size + 2:
-                packet_data = packet_buffer[:packet_size+2]
-                packet_buffer = packet_buffer[packet_size+2:]
-                return packet_data
-        data = s.recv(5)
-        if len(data) == 0:
-            return None
-        packet_buffer += data
-
-
+    decoder = decoders.get(s)
+    if decoder is None:
+        decoder = decoders[s] = WordPacketDecoder(s)
+    return decoder.next_packet()
 
 def extract_word(word_packet):
     """
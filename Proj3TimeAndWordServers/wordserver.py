@@ -30,28 +30,83 @@ WORDS = [
 import sys
 import socket
 import random
+import argparse
+import selectors
+import time
+from array import array
+from collections import deque
 
 # How many bytes is the word length?
 WORD_LEN_SIZE = 2
 
-def usage():
-    print("usage: wordserver.py port", file=sys.stderr)
+# Words sent per sendall() in bulk mode
+BULK_CHUNK_WORDS = 65536
 
-def build_word_packet(word_count):
-    word_packet = b''
-    word_list = []
+# With --select, clients are fed slices of a pool of random chunks built
+# once at startup, so a connection only holds a view into shared bytes
+POOL_CHUNKS = 64
+POOL_CHUNK_WORDS = 16384
+
+# Seconds to stop watching the listening socket after accept() fails
+ACCEPT_RETRY_DELAY = 0.1
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="wordserver.py")
+    parser.add_argument("port", type=int)
+    parser.add_argument("word_count", type=int, nargs="?",
+                        help="send this many words to every client instead of 1-9")
+    parser.add_argument("--select", action="store_true",
+                        help="serve all clients at once from a selectors event loop")
+    parser.add_argument("--stream", action="store_true",
+                        help="with --select, send words until the client hangs up")
+    parser.add_argument("--quiet", action="store_true",
+                        help="don't log connections")
+    parser.add_argument("--log-interval", type=float, default=1.0,
+                        help="with --select, seconds between summary log lines")
+    args = parser.parse_args(argv[1:])
+    if args.word_count is not None and args.word_count < 0:
+        parser.error("word_count can't be negative")
+    return args
 
-    for _ in range(word_count):
-        word = random.choice(WORDS)
-        word_bytes = word.encode()
-        word_len = len(word)
-        word_len_bytes = word_len.to_bytes(WORD_LEN_SIZE, "big")
+def encode_word_packet(word):
+    word_bytes = word.encode()
+    word_len_bytes = len(word_bytes).to_bytes(WORD_LEN_SIZE, "big")
+    return word_len_bytes + word_bytes
 
-        word_packet += word_len_bytes + word_bytes
-        word_list.append(word)
+# The length-prefixed packet for every word, encoded once up front
+WORD_PACKETS = [encode_word_packet(word) for word in WORDS]
+
+def build_word_packet(word_count):
+    indexes = random.choices(range(len(WORDS)), k=word_count)
+
+    word_packet = b''.join([WORD_PACKETS[i] for i in indexes])
+    word_list = [WORDS[i] for i in indexes]
 
     return word_packet, word_list
-        
+
+def build_word_chunk(word_count):
+    """
+    Return word_count random word packets joined together, without
+    keeping the list of words.
+    """
+    return b''.join(random.choices(WORD_PACKETS, k=word_count))
+
+def build_chunk_pool(chunk_count, chunk_words):
+    """
+    Return chunk_count random word chunks, each with the byte offset of
+    every word in it (and of its end), so whole words can be sliced out.
+    """
+    pool = []
+    for _ in range(chunk_count):
+        indexes = random.choices(range(len(WORDS)), k=chunk_words)
+        starts = array("I", [0])
+        offset = 0
+        for i in indexes:
+            offset += len(WORD_PACKETS[i])
+            starts.append(offset)
+        pool.append((b''.join([WORD_PACKETS[i] for i in indexes]), starts))
+    return pool
+
 def send_words(s):
     word_count = random.randrange(1, 10)
 
@@ -61,32 +116,230 @@ def send_words(s):
 
     return word_list
 
-def main(argv):
-
-    try:
-        port = int(argv[1])
-    except:
-        usage()
-        return 1
+def send_bulk_words(s, word_count):
+    """
+    Send word_count random words, BULK_CHUNK_WORDS at a time, so even
+    millions of words go out in a handful of large sendall() calls without
+    the whole stream ever being built in memory.
 
-    s = socket.socket()
-    s.bind(('', port))
-    s.listen()
+    Returns the number of bytes sent.
+    """
+    sent = 0
+    while word_count > 0:
+        chunk_words = min(word_count, BULK_CHUNK_WORDS)
+        chunk = build_word_chunk(chunk_words)
+        s.sendall(chunk)
+        sent += len(chunk)
+        word_count -= chunk_words
+    return sent
 
+def run_blocking_server(s, bulk_count, quiet):
+    """
+    Serve one client at a time: send its words, hang up, accept the next.
+    """
     while True:
-        print("-----------------------")
-        print("Waiting for connections")
-        print("-----------------------")
+        if not quiet:
+            print("-----------------------")
+            print("Waiting for connections")
+            print("-----------------------")
 
         new_s, connection_info = s.accept()
 
-        print(f"Got connection from {connection_info}")
+        if not quiet:
+            print(f"Got connection from {connection_info}")
+
+        try:
+            if bulk_count is None:
+                word_list = send_words(new_s)
+
+                if not quiet:
+                    print(f"Sent words: {','.join(word_list)}")
+            else:
+                sent = send_bulk_words(new_s, bulk_count)
+
+                if not quiet:
+                    print(f"Sent {bulk_count} words, {sent} bytes")
+        except OSError as e:
+            # The client hung up early, move on to the next one
+            if not quiet:
+                print(f"Lost connection to {connection_info}: {e}")
+        finally:
+            new_s.close()
+
+class WordConnection:
+    """
+    Event loop state for one client: the chunks waiting to be written, how
+    far into the first one we got, and how many words are still to be
+    sent (None when streaming until the client hangs up).
+    """
+
+    def __init__(self, sock, remaining, pool):
+        self.sock = sock
+        self.out_queue = deque()
+        self.out_offset = 0
+        self.remaining = remaining
+        self.pool = pool
 
-        word_list = send_words(new_s)
+    def refill(self):
+        """
+        Queue the next run of words once the previous one is written: a
+        view from a random word of a random pool chunk up to the end of it,
+        or fewer words if that is all that's left to send.
+        """
+        if self.remaining == 0:
+            return
+        chunk, starts = random.choice(self.pool)
+        first = random.randrange(len(starts) - 1)
+        last = len(starts) - 1
+        if self.remaining is not None:
+            last = min(last, first + self.remaining)
+            self.remaining -= last - first
+        self.out_queue.append(memoryview(chunk)[starts[first]:starts[last]])
+
+    def send(self):
+        """
+        Write as much of the queue as the socket takes without blocking.
+        Returns the number of bytes written, and raises BlockingIOError if
+        the socket is full.
+        """
+        if not self.out_queue:
+            self.refill()
+            if not self.out_queue:
+                return 0
+        chunk = self.out_queue[0]
+        sent = self.sock.send(chunk[self.out_offset:])
+        self.out_offset += sent
+        if self.out_offset == len(chunk):
+            self.out_queue.popleft()
+            self.out_offset = 0
+        return sent
+
+    def finished(self):
+        return not self.out_queue and self.remaining == 0
+
+class ServerStats:
+    """
+    Counters for the event loop, printed as one summary line per interval
+    rather than a line per connection.
+    """
+
+    def __init__(self, interval, quiet):
+        self.interval = interval
+        self.quiet = quiet
+        self.accepted = 0
+        self.closed = 0
+        self.bytes = 0
+        self.accept_errors = 0
+        self.last_accept_error = None
+        self.last_log = time.monotonic()
+
+    def maybe_log(self, open_count):
+        now = time.monotonic()
+        elapsed = now - self.last_log
+        if self.quiet or elapsed < self.interval:
+            return
+        print(f"{open_count} open, {self.accepted / elapsed:.0f} conn/s accepted, "
+              f"{self.closed} closed, {self.bytes / elapsed / 1e6:.1f} MB/s")
+        if self.accept_errors:
+            print(f"{self.accept_errors} failed accepts, last: {self.last_accept_error}")
+        self.accepted = 0
+        self.closed = 0
+        self.bytes = 0
+        self.accept_errors = 0
+        self.last_log = now
+
+def accept_clients(s, sel, args, stats, pool):
+    """
+    Accept every pending connection, not just one per wakeup. Returns
+    False if accept() failed, out of file descriptors say.
+    """
+    while True:
+        try:
+            new_s, connection_info = s.accept()
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            # EMFILE, ENFILE, ECONNABORTED...
+            stats.accept_errors += 1
+            stats.last_accept_error = e
+            return False
+        new_s.setblocking(False)
+        if args.stream:
+            remaining = None
+        elif args.word_count is not None:
+            remaining = args.word_count
+        else:
+            remaining = random.randrange(1, 10)
+        if remaining == 0:
+            # Nothing to send, hang up straight away
+            new_s.close()
+            stats.accepted += 1
+            stats.closed += 1
+            continue
+        sel.register(new_s, selectors.EVENT_WRITE, WordConnection(new_s, remaining, pool))
+        stats.accepted += 1
+
+def close_client(sel, conn, stats):
+    sel.unregister(conn.sock)
+    conn.sock.close()
+    stats.closed += 1
+
+def run_select_server(s, args):
+    """
+    Serve every client at once from a single thread. Sockets are
+    non-blocking, so a slow reader only holds up its own queue.
+    """
+    sel = selectors.DefaultSelector()
+    s.setblocking(False)
+    sel.register(s, selectors.EVENT_READ)
+    stats = ServerStats(args.log_interval, args.quiet)
+    pool = build_chunk_pool(POOL_CHUNKS, POOL_CHUNK_WORDS)
+    paused_until = None
+
+    while True:
+        timeout = args.log_interval
+        if paused_until is not None:
+            wait = paused_until - time.monotonic()
+            if wait <= 0:
+                sel.register(s, selectors.EVENT_READ)
+                paused_until = None
+            else:
+                timeout = min(timeout, wait)
+
+        for key, events in sel.select(timeout=timeout):
+            if key.fileobj is s:
+                if not accept_clients(s, sel, args, stats, pool):
+                    # The pending connections stay pending, and select()
+                    # would keep waking us to fail on them again, so leave
+                    # them alone for a moment
+                    sel.unregister(s)
+                    paused_until = time.monotonic() + ACCEPT_RETRY_DELAY
+                continue
+            conn = key.data
+            try:
+                stats.bytes += conn.send()
+            except BlockingIOError:
+                continue
+            except OSError:
+                # The client hung up, typically the end of a stream
+                close_client(sel, conn, stats)
+                continue
+            if conn.finished():
+                close_client(sel, conn, stats)
+        stats.maybe_log(len(sel.get_map()) - (paused_until is None))
+
+def main(argv):
+    args = parse_args(argv)
+
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(('', args.port))
+    s.listen(1024)
 
-        print(f"Sent words: {','.join(word_list)}")
+    if args.select:
+        run_select_server(s, args)
+    else:
+        run_blocking_server(s, args.word_count, args.quiet)
 
-        new_s.close()
-        
 if __name__ == "__main__":
-    sys.exit(main(sys.argv))
\ No newline at end of file
+    sys.exit(main(sys.argv))
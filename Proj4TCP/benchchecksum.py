@@ -0,0 +1,192 @@
+'''
+Benchmarks the TCP checksum implementations against each other.
+
+Synthetic segments are generated with a chosen size distribution (odd
+lengths included, so the zero padding in generate_tcp_zero_chksm() gets
+exercised), a fraction of them with a corrupted byte. Every backend
+checksums every segment, the answers are checked against each other and
+against which segments were corrupted, and segments/s and MB/s are
+reported per backend. The ten tcp_data_n.dat samples are checked first
+as a fixture: 0-4 must pass and 5-9 must fail.
+
+Example usage:
+
+python benchchecksum.py --count 100000 --sizes imix --corrupt 0.1
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+import inetchecksum
+import validatetcp
+from tcpview import TCPSegment, TCP_HEADER_SIZE
+
+# Expected results of the sample files in this directory
+FIXTURE_EXPECTED = [True] * 5 + [False] * 5
+
+# Typical mix of TCP segment sizes on a link: mostly pure ACKs, some
+# mid-sized, some full MSS. One byte is added to a third of them to get
+# odd lengths.
+IMIX = [(40, 7), (576, 4), (1460, 1)]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="benchchecksum.py")
+    parser.add_argument("--count", type=int, default=20000,
+                        help="number of synthetic segments")
+    parser.add_argument("--sizes", choices=("uniform", "imix", "fixed"), default="uniform",
+                        help="segment size distribution")
+    parser.add_argument("--min-size", type=int, default=20)
+    parser.add_argument("--max-size", type=int, default=1500,
+                        help="largest segment, or the size used with --sizes fixed")
+    parser.add_argument("--corrupt", type=float, default=0.1,
+                        help="fraction of segments with a corrupted byte")
+    parser.add_argument("--buffer-mb", type=float, default=16,
+                        help="size of the single buffer for the raw sum test, 0 to skip")
+    parser.add_argument("--backends",
+                        help="comma separated backends to run (default all)")
+    parser.add_argument("--seed", type=int, default=372)
+    return parser.parse_args(argv[1:])
+
+def segment_sizes(args, rng):
+    if args.sizes == "fixed":
+        return [args.max_size] * args.count
+    if args.sizes == "imix":
+        sizes, weights = zip(*IMIX)
+        chosen = rng.choices(sizes, weights, k=args.count)
+        return [size + (rng.random() < 1 / 3) for size in chosen]
+    return [rng.randint(args.min_size, args.max_size) for _ in range(args.count)]
+
+def reference_checksum(source, dest, data):
+    '''
+    The step by step path: build the pseudo header, copy the segment with
+    the checksum zeroed (and padded to even length), sum word by word
+    '''
+    length = len(data).to_bytes(2, byteorder='big')
+    pseudo_header = validatetcp.generate_pseudo_header(source, dest, validatetcp.PROTOCOL, length)
+    tcp_zero_chksum = validatetcp.generate_tcp_zero_chksm(data)
+    return inetchecksum.internet_checksum(pseudo_header, tcp_zero_chksum, backend="loop")
+
+def generate_segments(args):
+    '''
+    Returns a list of (source, dest, data, valid) with correct checksums
+    filled in, and a random byte flipped in the invalid ones
+    '''
+    rng = random.Random(args.seed)
+    segments = []
+    for size in segment_sizes(args, rng):
+        size = max(size, TCP_HEADER_SIZE)
+        source = rng.randbytes(4)
+        dest = rng.randbytes(4)
+        data = bytearray(rng.randbytes(size))
+        data[16:18] = reference_checksum(source, dest, data).to_bytes(2, "big")
+        valid = rng.random() >= args.corrupt
+        if not valid:
+            # XOR with a non-zero value always changes the word sum
+            position = rng.randrange(size)
+            data[position] ^= rng.randrange(1, 256)
+        segments.append((source, dest, bytes(data), valid))
+    return segments
+
+def make_backends():
+    '''
+    Each backend maps (source, dest, data) to the checksum the segment
+    should carry
+    '''
+    backends = {"reference": reference_checksum}
+
+    def zeroed(name):
+        def run(source, dest, data):
+            length = len(data).to_bytes(2, byteorder='big')
+            pseudo_header = validatetcp.generate_pseudo_header(
+                source, dest, validatetcp.PROTOCOL, length)
+            tcp_zero_chksum = validatetcp.generate_tcp_zero_chksm(data)
+            return inetchecksum.internet_checksum(pseudo_header, tcp_zero_chksum, backend=name)
+        return run
+
+    for name in inetchecksum.BACKENDS:
+        if name != "loop":
+            backends[name] = zeroed(name)
+    backends["view"] = lambda source, dest, data: TCPSegment(data).computed_checksum(source, dest)
+    return backends
+
+def check_fixture(backends):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for i, expected in enumerate(FIXTURE_EXPECTED):
+        source, dest = validatetcp.get_source_and_dest(os.path.join(directory, f'tcp_addrs_{i}.txt'))
+        source_bytes = validatetcp.ip_to_bytes(source)
+        dest_bytes = validatetcp.ip_to_bytes(dest)
+        with open(os.path.join(directory, f'tcp_data_{i}.dat'), 'rb') as f:
+            data = f.read()
+        stored = int.from_bytes(data[16:18], "big")
+        for name, backend in backends.items():
+            if (backend(source_bytes, dest_bytes, data) == stored) != expected:
+                print(f"fixture tcp_data_{i}.dat: {name} disagrees", file=sys.stderr)
+                return False
+    print(f"Fixture: {len(FIXTURE_EXPECTED)} sample segments agree across "
+          f"{len(backends)} backends")
+    return True
+
+def run_segments(backend, segments):
+    '''
+    Times one backend over all segments. Returns the checksums and the
+    elapsed time.
+    '''
+    start = time.perf_counter()
+    results = [backend(source, dest, data) for source, dest, data, _ in segments]
+    return results, time.perf_counter() - start
+
+def run_buffer(size):
+    data = os.urandom(size)
+    print(f"Raw ones' complement sum over one {size / 1e6:.0f} MB buffer:")
+    answers = set()
+    for name, summer in inetchecksum.BACKENDS.items():
+        if name == "loop" and size > 4_000_000:
+            # Far too slow to be worth waiting for on big buffers
+            continue
+        start = time.perf_counter()
+        answers.add(summer(data))
+        elapsed = time.perf_counter() - start
+        print(f"  {name:>9s}: {size / elapsed / 1e6:10.1f} MB/s")
+    return len(answers) == 1
+
+def main(argv):
+    args = parse_args(argv)
+    backends = make_backends()
+    if args.backends:
+        wanted = args.backends.split(",")
+        backends = {name: run for name, run in backends.items() if name in wanted}
+
+    if not check_fixture(backends):
+        return 1
+
+    segments = generate_segments(args)
+    total_bytes = sum(len(data) for _, _, data, _ in segments)
+    odd = sum(len(data) % 2 for _, _, data, _ in segments)
+    print(f"Segments: {len(segments)} ({args.sizes}), {total_bytes / 1e6:.1f} MB, "
+          f"{odd} odd length, {sum(not valid for *_, valid in segments)} corrupted")
+
+    agreed = True
+    baseline = None
+    for name, backend in backends.items():
+        results, elapsed = run_segments(backend, segments)
+        verdicts = [result == int.from_bytes(data[16:18], "big")
+                    for result, (_, _, data, _) in zip(results, segments)]
+        wrong = sum(verdict != valid for verdict, (*_, valid) in zip(verdicts, segments))
+        if baseline is None:
+            baseline = results
+        mismatched = sum(a != b for a, b in zip(results, baseline))
+        agreed = agreed and wrong == 0 and mismatched == 0
+        print(f"  {name:>9s}: {len(segments) / elapsed:12,.0f} segments/s "
+              f"{total_bytes / elapsed / 1e6:8.1f} MB/s  "
+              f"{wrong} wrong verdicts, {mismatched} differ from {next(iter(backends))}")
+
+    if args.buffer_mb > 0:
+        agreed = run_buffer(int(args.buffer_mb * 1e6)) and agreed
+
+    print("All backends agree" if agreed else "BACKENDS DISAGREE")
+    return 0 if agreed else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
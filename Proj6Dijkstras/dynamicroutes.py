@@ -0,0 +1,376 @@
+'''
+Keeps shortest path trees up to date while the topology changes.
+
+The compiled graph is turned into per-router dicts of outgoing and
+incoming links so links can be changed in place. Full shortest path
+trees are cached per source router, like routergraph.TreeCache, and every
+change event repairs the cached trees instead of throwing them away:
+
+    weight decrease or new link u->v
+        if it gives v a shorter distance, the improvement is pushed
+        outwards from v with Dijkstra, touching only routers whose
+        distance actually drops
+
+    weight increase or removed link u->v
+        nothing to do unless u->v is a tree link. If it is, only the
+        subtree hanging below v can get longer: those routers are reset,
+        seeded with their best link from outside the subtree, and settled
+        again with Dijkstra
+
+    router down
+        all its links are removed at once and the subtrees below every
+        removed tree link are repaired together. A tree rooted at the
+        router itself is dropped.
+
+Events are read as JSON lines:
+
+{"event": "weight", "from": "10.34.98.1", "to": "10.34.46.1", "ad": 12}
+{"event": "add", "from": "10.34.98.1", "to": "10.34.52.1", "ad": 40}
+{"event": "remove", "from": "10.34.98.1", "to": "10.34.46.1"}
+{"event": "down", "router": "10.34.46.1"}
+{"event": "routes"}
+
+Link events change the one direction given, or both directions with
+"both": true. "weight" only changes links that exist, "add" also creates
+them, and "ad" must be a number no less than 0. "routes" prints the routes
+of the topology's src-dest pairs as they are at that point, in the same
+format as dijkstra.py. Without any "routes" events they are printed once
+at the end.
+
+A bad event (not JSON, an unknown event or router, a missing field, a bad
+"ad", a "weight" for a missing link or a link on a router that is down) is
+reported on stderr with its line number and skipped, leaving the graph as
+it was. The rest of the events are still applied.
+
+Example usage:
+
+python dynamicroutes.py example1.json events.jsonl
+'''
+
+import sys
+import json
+import math
+import heapq
+import time
+import argparse
+from collections import OrderedDict
+import routergraph
+
+class DynamicGraph:
+    '''
+    A RouterGraph whose links can be changed. out_links[u] maps neighbor
+    to weight for the links out of router u, and in_links[v] the same for
+    the links into v.
+    '''
+    def __init__(self, graph):
+        self.ips = graph.ips
+        self.index = graph.index
+        self.prefixes = graph.prefixes
+        self.out_links = [{} for _ in range(len(graph))]
+        self.in_links = [{} for _ in range(len(graph))]
+        self.down = set()
+        for node in range(len(graph)):
+            for neighbor, weight in graph.links(node):
+                self.out_links[node][neighbor] = weight
+                self.in_links[neighbor][node] = weight
+
+    def __len__(self):
+        return len(self.ips)
+
+    def router(self, ip):
+        node = self.index.get(ip) if isinstance(ip, str) else None
+        if node is None:
+            raise ValueError(f"{ip!r} is not a router")
+        return node
+
+    def find_router(self, ip):
+        '''
+        Index of the router serving ip, or -1 if there is none or it is down
+        '''
+        router = self.prefixes.lookup(ip)
+        if router is None or router in self.down:
+            return -1
+        return router
+
+    def set_link(self, node, neighbor, weight):
+        '''
+        Adds the link or changes its weight. Returns the old weight, or None
+        if the link is new.
+        '''
+        if node in self.down or neighbor in self.down:
+            raise ValueError(f"link {self.ips[node]} -> {self.ips[neighbor]} is on a router that is down")
+        old = self.out_links[node].get(neighbor)
+        self.out_links[node][neighbor] = weight
+        self.in_links[neighbor][node] = weight
+        return old
+
+    def remove_link(self, node, neighbor):
+        '''
+        Returns the removed link's weight, or None if there was no such link
+        '''
+        self.in_links[neighbor].pop(node, None)
+        return self.out_links[node].pop(neighbor, None)
+
+    def router_down(self, node):
+        '''
+        Removes every link into and out of the router. Returns the removed
+        links as (node, neighbor) pairs.
+        '''
+        removed = [(node, neighbor) for neighbor in self.out_links[node]]
+        removed += [(neighbor, node) for neighbor in self.in_links[node]]
+        for neighbor in self.out_links[node]:
+            del self.in_links[neighbor][node]
+        for neighbor in self.in_links[node]:
+            del self.out_links[neighbor][node]
+        self.out_links[node].clear()
+        self.in_links[node].clear()
+        self.down.add(node)
+        return removed
+
+def event_field(event, name):
+    if name not in event:
+        raise ValueError(f"event has no {name!r}")
+    return event[name]
+
+def event_weight(event):
+    '''
+    The event's "ad", checked to be a finite number no less than 0, which
+    the tree repairs rely on
+    '''
+    ad = event_field(event, "ad")
+    if (isinstance(ad, bool) or not isinstance(ad, (int, float))
+            or not math.isfinite(ad) or ad < 0):
+        raise ValueError(f'"ad" must be a number no less than 0, not {ad!r}')
+    return ad
+
+def propagate(graph, distance, parent, heap):
+    '''
+    Dijkstra from the (distance, router) entries on heap, relaxing only
+    links that improve a distance. Returns how many routers were settled.
+    '''
+    out_links = graph.out_links
+    settled = 0
+    while heap:
+        current_distance, current_node = heapq.heappop(heap)
+        if current_distance > distance[current_node]:
+            # Stale entry, the router was improved again since
+            continue
+        settled += 1
+        for neighbor, weight in out_links[current_node].items():
+            computed_distance = current_distance + weight
+            if computed_distance < distance[neighbor]:
+                distance[neighbor] = computed_distance
+                parent[neighbor] = current_node
+                heapq.heappush(heap, (computed_distance, neighbor))
+    return settled
+
+def full_tree(graph, source):
+    distance = [math.inf] * len(graph)
+    parent = [-1] * len(graph)
+    distance[source] = 0
+    propagate(graph, distance, parent, [(0, source)])
+    return distance, parent
+
+def subtree(graph, parent, roots):
+    '''
+    The routers whose tree path runs through any of roots, roots included
+    '''
+    found = set(roots)
+    stack = list(found)
+    while stack:
+        node = stack.pop()
+        for neighbor in graph.out_links[node]:
+            if parent[neighbor] == node and neighbor not in found:
+                found.add(neighbor)
+                stack.append(neighbor)
+    return found
+
+def repair_decrease(graph, distance, parent, node, neighbor, weight):
+    '''
+    Repairs a tree after node -> neighbor got cheaper or was added. Returns
+    how many routers were settled again.
+    '''
+    computed_distance = distance[node] + weight
+    if computed_distance >= distance[neighbor]:
+        return 0
+    distance[neighbor] = computed_distance
+    parent[neighbor] = node
+    return propagate(graph, distance, parent, [(computed_distance, neighbor)])
+
+def repair_increase(graph, distance, parent, roots):
+    '''
+    Repairs a tree after the tree links into roots got more expensive or
+    were removed. Returns how many routers were settled again.
+    '''
+    affected = subtree(graph, parent, roots)
+    for node in affected:
+        distance[node] = math.inf
+        parent[node] = -1
+
+    heap = []
+    for node in affected:
+        for neighbor, weight in graph.in_links[node].items():
+            computed_distance = distance[neighbor] + weight
+            if computed_distance < distance[node]:
+                distance[node] = computed_distance
+                parent[node] = neighbor
+        if distance[node] < math.inf:
+            heap.append((distance[node], node))
+    heapq.heapify(heap)
+    return propagate(graph, distance, parent, heap)
+
+class DynamicRoutes:
+    '''
+    Shortest path trees over a DynamicGraph, kept in an LRU of max_trees
+    and repaired as the graph changes
+    '''
+    def __init__(self, graph, max_trees=32):
+        self.graph = DynamicGraph(graph)
+        self.max_trees = max_trees
+        self.trees = OrderedDict()
+        self.computed = 0
+        self.repaired = 0
+
+    def tree(self, source):
+        tree = self.trees.get(source)
+        if tree is not None:
+            self.trees.move_to_end(source)
+            return tree
+        self.computed += 1
+        tree = self.trees[source] = full_tree(self.graph, source)
+        while len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return tree
+
+    def route_batch(self, src_dest_pairs):
+        '''
+        Like routergraph.route_batch(): the path for every pair, in order
+        '''
+        graph = self.graph
+        paths = [[] for _ in src_dest_pairs]
+        by_source = {}
+        for i, (src_ip, dest_ip) in enumerate(src_dest_pairs):
+            first_router = graph.find_router(src_ip)
+            final_router = graph.find_router(dest_ip)
+            if first_router == final_router or first_router < 0 or final_router < 0:
+                continue
+            by_source.setdefault(first_router, []).append((i, final_router))
+
+        for first_router, queries in by_source.items():
+            _, parent = self.tree(first_router)
+            for i, final_router in queries:
+                paths[i] = routergraph.tree_path(graph, first_router, final_router, parent)
+        return paths
+
+    def set_link(self, node, neighbor, weight):
+        old = self.graph.set_link(node, neighbor, weight)
+        for distance, parent in self.trees.values():
+            if old is None or weight < old:
+                self.repaired += repair_decrease(self.graph, distance, parent,
+                                                 node, neighbor, weight)
+            elif weight > old and parent[neighbor] == node:
+                self.repaired += repair_increase(self.graph, distance, parent, [neighbor])
+
+    def remove_link(self, node, neighbor):
+        if self.graph.remove_link(node, neighbor) is None:
+            return
+        for distance, parent in self.trees.values():
+            if parent[neighbor] == node:
+                self.repaired += repair_increase(self.graph, distance, parent, [neighbor])
+
+    def router_down(self, node):
+        removed = self.graph.router_down(node)
+        self.trees.pop(node, None)
+        for distance, parent in self.trees.values():
+            roots = [neighbor for source, neighbor in removed if parent[neighbor] == source]
+            if roots:
+                self.repaired += repair_increase(self.graph, distance, parent, roots)
+
+    def apply(self, event):
+        '''
+        Applies one change event (see the module docstring). Raises
+        ValueError for a bad event, which is then not applied at all.
+        '''
+        if not isinstance(event, dict):
+            raise ValueError("event is not a JSON object")
+        kind = event_field(event, "event")
+        graph = self.graph
+        if kind == "down":
+            self.router_down(graph.router(event_field(event, "router")))
+            return
+        if kind not in ("weight", "add", "remove"):
+            raise ValueError(f"unknown event {kind!r}")
+
+        node = graph.router(event_field(event, "from"))
+        neighbor = graph.router(event_field(event, "to"))
+        links = [(node, neighbor)]
+        if event.get("both"):
+            links.append((neighbor, node))
+
+        if kind == "remove":
+            for link in links:
+                self.remove_link(*link)
+            return
+        weight = event_weight(event)
+        for link_node, link_neighbor in links:
+            if link_node in graph.down or link_neighbor in graph.down:
+                raise ValueError(f"link {graph.ips[link_node]} -> {graph.ips[link_neighbor]} "
+                                 f"is on a router that is down")
+            if kind == "weight" and link_neighbor not in graph.out_links[link_node]:
+                raise ValueError(f"no link {graph.ips[link_node]} -> {graph.ips[link_neighbor]} "
+                                 f"to change the weight of")
+        for link in links:
+            self.set_link(*link, weight)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="dynamicroutes.py")
+    parser.add_argument("infile", help="topology JSON file")
+    parser.add_argument("events", help="JSON lines file of change events, - for stdin")
+    parser.add_argument("--snapshot",
+                        help="binary graph snapshot to load instead of the JSON when "
+                             "it is up to date, and to save otherwise")
+    parser.add_argument("--max-trees", type=int, default=32,
+                        help="shortest path trees kept")
+    return parser.parse_args(argv[1:])
+
+def print_routes(routes, src_dest_pairs):
+    for (src_ip, dest_ip), path in zip(src_dest_pairs, routes.route_batch(src_dest_pairs)):
+        print(f"{src_ip:>15s} -> {dest_ip:<15s}  {repr(path)}")
+
+def main(argv):
+    args = parse_args(argv)
+    graph, src_dest_pairs = routergraph.load_topology(args.infile, args.snapshot)
+    routes = DynamicRoutes(graph, args.max_trees)
+
+    events = sys.stdin if args.events == "-" else open(args.events)
+    printed = False
+    applied = 0
+    skipped = 0
+    start = time.perf_counter()
+    with events:
+        for line_number, line in enumerate(events, 1):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+                if isinstance(event, dict) and event.get("event") == "routes":
+                    print_routes(routes, src_dest_pairs)
+                    print()
+                    printed = True
+                else:
+                    routes.apply(event)
+                    applied += 1
+            except ValueError as e:
+                print(f"{args.events}:{line_number}: {e}, skipped", file=sys.stderr)
+                skipped += 1
+    if not printed:
+        print_routes(routes, src_dest_pairs)
+
+    elapsed = time.perf_counter() - start
+    print(f"{applied} events in {elapsed:.2f}s ({skipped} skipped): "
+          f"{routes.computed} trees computed, "
+          f"{routes.repaired} routers settled again by repairs", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,142 @@
+'''
+Builds the full forwarding table of every router in a topology.
+
+Each router's table comes from one shortest path tree rooted at it (the
+same paths dijkstras_shortest_path() finds): for every destination
+network it gives the next hop router, the interface that leads there and
+the total administrative distance. Trees are computed in a process pool.
+The compiled graph is handed to the workers when they start, which on
+platforms with fork means they share the parent's copy of it.
+
+Tables are written as JSON lines, one router per line:
+
+{"router": "10.34.98.1", "routes": [{"network": "10.34.46.0/24",
+ "next_hop": "10.34.46.1", "interface": "en2", "cost": 64}, ...]}
+
+The router's own network is listed with a null next hop and interface.
+
+Example usage:
+
+python forwarding.py example1.json tables.jsonl --workers 4
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import netfuncs
+import routergraph
+
+# Graph the worker processes build tables from and its network names, set
+# by set_worker_graph()
+worker_graph = None
+worker_names = None
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="forwarding.py")
+    parser.add_argument("infile", help="topology JSON file")
+    parser.add_argument("outfile", help="JSON lines file to write, - for stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default one per CPU)")
+    parser.add_argument("--batch", type=int, default=64,
+                        help="routers handed to a worker at a time")
+    parser.add_argument("--snapshot",
+                        help="binary graph snapshot to load instead of the JSON when "
+                             "it is up to date, and to save otherwise")
+    return parser.parse_args(argv[1:])
+
+def set_worker_graph(graph):
+    global worker_graph, worker_names
+    worker_graph = graph
+    worker_names = network_names(graph)
+
+def network_names(graph):
+    '''
+    "a.b.c.d/n" for each router's network
+    '''
+    return [f"{netfuncs.value_to_ipv4(network)}/{routergraph.prefix_length(mask)}"
+            for network, mask in zip(graph.networks, graph.masks)]
+
+def forwarding_table(graph, source, names):
+    '''
+    The routes of router index source, as a list of dicts
+    '''
+    distance, parent = routergraph.shortest_path_tree(graph, source)
+    hops = routergraph.first_hops(source, parent)
+    interfaces = {}
+    routes = [{"network": names[source], "next_hop": None, "interface": None, "cost": 0}]
+    for destination in range(len(graph)):
+        hop = hops[destination]
+        if hop < 0:
+            continue
+        if hop not in interfaces:
+            interfaces[hop] = graph.interface(source, hop)
+        routes.append({
+            "network": names[destination],
+            "next_hop": graph.ips[hop],
+            "interface": interfaces[hop],
+            "cost": distance[destination],
+        })
+    return routes
+
+def table_lines(start, stop):
+    '''
+    Worker task: the JSON lines for routers start up to stop
+    '''
+    graph = worker_graph
+    names = worker_names
+    lines = []
+    for source in range(start, stop):
+        table = {"router": graph.ips[source], "routes": forwarding_table(graph, source, names)}
+        lines.append(json.dumps(table, separators=(",", ":")) + "\n")
+    return lines
+
+def pool_context():
+    '''
+    fork where the platform has it, so workers inherit the graph instead of
+    unpickling their own copy
+    '''
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def write_tables(graph, out, workers=1, batch=64):
+    '''
+    Writes the forwarding table of every router to out, in router order
+    '''
+    starts = range(0, len(graph), batch)
+    stops = [min(start + batch, len(graph)) for start in starts]
+
+    if workers <= 1:
+        set_worker_graph(graph)
+        for start, stop in zip(starts, stops):
+            out.writelines(table_lines(start, stop))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(),
+                             initializer=set_worker_graph, initargs=(graph,)) as pool:
+        for lines in pool.map(table_lines, starts, stops):
+            out.writelines(lines)
+
+def main(argv):
+    args = parse_args(argv)
+
+    start = time.perf_counter()
+    graph, _ = routergraph.load_topology(args.infile, args.snapshot)
+
+    if args.outfile == "-":
+        write_tables(graph, sys.stdout, args.workers, args.batch)
+    else:
+        with open(args.outfile, "w") as out:
+            write_tables(graph, out, args.workers, args.batch)
+
+    elapsed = time.perf_counter() - start
+    print(f"{len(graph)} forwarding tables in {elapsed:.2f}s with {args.workers} workers",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,6 +1,21 @@
 import sys
-import json
+import socket
+from array import array
+from functools import lru_cache
+import topostream
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Distinct addresses remembered by ipv4_to_value() and value_to_ipv4()
+ADDRESS_CACHE_SIZE = 1 << 16
+
+# Maps the digits 1-9 to 1 for plain_dotted_decimal()
+LEADING_ZERO_DIGITS = bytes.maketrans(b"23456789", b"11111111")
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
 def ipv4_to_value(ipv4_addr):
     """
     Convert a dots-and-numbers IP address to a single 32-bit numeric
@@ -13,14 +28,20 @@ def ipv4_to_value(ipv4_addr):
 
     ipv4_addr: "1.2.3.4"
     return:    16909060  (Which is 0x01020304 hex)
-    """
-    values = ipv4_addr.split(".")
-    hex_string = ""
-    for val in values:
-        hex_string += format(int(val), '02x')
-    dec_string = int(hex_string, 16)
-    return dec_string
 
+    Raises ValueError unless the address is exactly four decimal numbers
+    from 0 to 255. The most recent addresses are cached since the same
+    router IPs come up over and over.
+    """
+    parts = ipv4_addr.split(".")
+    if len(parts) != 4 or not all(part.isascii() and part.isdigit() for part in parts):
+        raise ValueError(f"not a dots-and-numbers IPv4 address: {ipv4_addr!r}")
+    a, b, c, d = map(int, parts)
+    if max(a, b, c, d) > 255:
+        raise ValueError(f"not a dots-and-numbers IPv4 address: {ipv4_addr!r}")
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
 def value_to_ipv4(addr):
     """
     Convert a single 32-bit numeric value of integer type to a
@@ -36,13 +57,76 @@ def value_to_ipv4(addr):
     addr:   0x01020304 0b00000001000000100000001100000100 16909060
     return: "1.2.3.4"
     """
-    addr_string = ""
-    hex_val = format(addr, '08x')
-    for i in range(0, len(hex_val), 2):
-        addr_string += str(int(hex_val[i:i+2], 16))
-        addr_string += "."
+    return socket.inet_ntoa(int(addr).to_bytes(4, "big"))
 
-    return addr_string[:-1]
+def plain_dotted_decimal(ipv4_addrs):
+    """
+    True if inet_aton() can only read the addresses the way ipv4_to_value()
+    does: nothing but digits and exactly three dots each, and no octet with
+    a leading zero (inet_aton() would read it as octal). Empty octets and
+    octets over 255 are left for inet_aton() to reject. Checked with a few
+    byte-level passes over all the addresses joined together.
+    """
+    try:
+        joined = "\n".join(ipv4_addrs).encode("ascii")
+    except UnicodeEncodeError:
+        return False
+    if joined.translate(None, b"0123456789.\n"):
+        return False
+    if joined.count(b".") != 3 * len(ipv4_addrs) or joined.count(b"\n") != len(ipv4_addrs) - 1:
+        return False
+    # With every other digit made a 1, an octet with a leading zero shows up
+    # as 00 or 01 right after a separator
+    ones = b"\n" + joined.translate(LEADING_ZERO_DIGITS)
+    return not any(pattern in ones for pattern in (b".00", b".01", b"\n00", b"\n01"))
+
+def ipv4_values(ipv4_addrs):
+    """
+    Convert a sequence of dots-and-numbers IP addresses to their 32-bit
+    values all at once. Returns a NumPy uint32 array when NumPy is
+    installed, otherwise an array('I'). Either way .tolist() gives plain
+    integers.
+
+    When plain_dotted_decimal() passes, every address goes through
+    inet_aton() into one big-endian buffer, which is then read as 32-bit
+    words in a single step. Anything else is converted one address at a
+    time by ipv4_to_value(), which raises ValueError on malformed
+    addresses. Arrays of values already converted are returned as they are.
+    """
+    if isinstance(ipv4_addrs, array) or (np is not None and isinstance(ipv4_addrs, np.ndarray)):
+        return ipv4_addrs
+    ipv4_addrs = list(ipv4_addrs)
+    packed = None
+    if plain_dotted_decimal(ipv4_addrs):
+        try:
+            packed = b"".join(map(socket.inet_aton, ipv4_addrs))
+        except OSError:
+            # e.g. an empty octet, reported properly by ipv4_to_value()
+            pass
+    if packed is None:
+        packed = b"".join(ipv4_to_value(ip).to_bytes(4, "big") for ip in ipv4_addrs)
+    if np is not None:
+        return np.frombuffer(packed, dtype=">u4").astype(np.uint32)
+    values = array('I')
+    values.frombytes(packed)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+def values_to_ipv4(addrs):
+    """
+    Convert a sequence of 32-bit values (list, array or NumPy array) to a
+    list of dots-and-numbers IP addresses
+    """
+    if np is not None:
+        packed = np.asarray(addrs, dtype=np.uint32).astype(">u4").tobytes()
+    else:
+        big_endian = array('I', addrs)
+        if sys.byteorder == "little":
+            big_endian.byteswap()
+        packed = big_endian.tobytes()
+    inet_ntoa = socket.inet_ntoa
+    return [inet_ntoa(packed[i:i+4]) for i in range(0, len(packed), 4)]
 
 def get_subnet_mask_value(slash):
     """
@@ -156,12 +240,215 @@ def find_router_for_ip(routers, ip):
     }
     ip: "1.2.5.6"
     return: None
+
+    This scans every router. Build a PrefixIndex to look up many IPs.
     """
     for key in routers:
         found = ips_same_subnet(key, ip, routers[key]["netmask"])
         if found:
             return key
     return None
+
+
+class PrefixIndex:
+    """
+    Longest prefix match index over router networks.
+
+    There is one hash table per prefix length, mapping network value to
+    the routers on that network. A lookup masks the address once per
+    prefix length in use, longest first, so it costs at most 33 dict
+    lookups however many routers there are. Routers can be added and
+    removed at any time.
+
+    Example:
+
+    index = PrefixIndex.from_routers(routers)
+    index.lookup("1.2.3.5")
+    return: "1.2.3.1"
+    """
+    def __init__(self):
+        # prefix length -> {network value: [router, ...]}
+        self.tables = {}
+        # (prefix length, mask) for every length in use, longest first
+        self.masks = []
+
+    @classmethod
+    def from_routers(cls, routers):
+        index = cls()
+        for router_ip, router in routers.items():
+            index.add(router_ip, router["netmask"])
+        return index
+
+    def update_masks(self):
+        self.masks = [(length, ((1 << length) - 1) << (32 - length))
+                      for length in sorted(self.tables, reverse=True)]
+
+    def add(self, router_ip, slash, router=None):
+        """
+        Adds router (router_ip if not given) for the network router_ip is
+        on. When several routers share a network, the first one added is
+        the one looked up.
+        """
+        mask = get_subnet_mask_value(slash)
+        network = get_network(ipv4_to_value(router_ip), mask)
+        self.add_network(network, bin(mask).count("1"),
+                         router_ip if router is None else router)
+
+    def add_network(self, network, length, router):
+        """
+        add() for a network already given as its value and prefix length
+        """
+        if length not in self.tables:
+            self.tables[length] = {}
+            self.update_masks()
+        self.tables[length].setdefault(network, []).append(router)
+
+    def remove(self, router_ip, slash, router=None):
+        """
+        Removes a router added with add(). Raises KeyError if it isn't there.
+        """
+        mask = get_subnet_mask_value(slash)
+        length = bin(mask).count("1")
+        network = get_network(ipv4_to_value(router_ip), mask)
+        table = self.tables.get(length, {})
+        routers = table.get(network)
+        if routers is None:
+            raise KeyError(router_ip)
+        routers.remove(router_ip if router is None else router)
+        if not routers:
+            del table[network]
+        if not table:
+            del self.tables[length]
+            self.update_masks()
+
+    def lookup_value(self, ip_value):
+        tables = self.tables
+        for length, mask in self.masks:
+            routers = tables[length].get(ip_value & mask)
+            if routers:
+                return routers[0]
+        return None
+
+    def lookup(self, ip):
+        """
+        The router on the most specific network containing ip, or None
+        """
+        return self.lookup_value(ipv4_to_value(ip))
+
+    def lookup_many(self, ips):
+        """
+        lookup() for each of a sequence of IPs, as a list
+        """
+        lookup_value = self.lookup_value
+        return [lookup_value(value) for value in ipv4_values(ips).tolist()]
+
+def prefix_lengths(slashes):
+    """
+    Mask lengths from a single slash mask ("/24" or 24) or a sequence of
+    them, as a list of integers
+    """
+    if isinstance(slashes, (int, str)):
+        slashes = [slashes]
+    return [int(slash[slash.find("/")+1:]) if isinstance(slash, str) else int(slash)
+            for slash in slashes]
+
+def same_subnets(src_ips, dest_ips, slashes):
+    """
+    ips_same_subnet() for many pairs at once. src_ips and dest_ips are
+    equal length sequences of dots-and-numbers addresses, and slashes is
+    either one mask for every pair or one per pair. Returns a NumPy bool
+    array with NumPy, otherwise a list of booleans.
+
+    With NumPy both address columns and the masks are arrays and the test
+    is three vectorized operations over all the pairs.
+    """
+    src_values = ipv4_values(src_ips)
+    dest_values = ipv4_values(dest_ips)
+    lengths = prefix_lengths(slashes)
+
+    if np is not None:
+        shifts = 32 - np.asarray(lengths, dtype=np.uint64)
+        masks = (np.uint64(0xffffffff) << shifts) & np.uint64(0xffffffff)
+        return ((src_values ^ dest_values) & masks) == 0
+
+    if len(lengths) == 1:
+        lengths = lengths * len(src_values)
+    return [(src ^ dest) & (((1 << length) - 1) << (32 - length)) == 0
+            for src, dest, length in zip(src_values, dest_values, lengths)]
+
+class NetworkTable:
+    """
+    The routers' networks laid out for finding the owning router of many
+    addresses at once. Routers are numbered in the dictionary's order and
+    the most specific network wins, like PrefixIndex.
+
+    With NumPy there is one sorted array of networks per prefix length.
+    Each batch of addresses is masked and binary searched against every
+    length, longest first, as whole-array operations. Without NumPy a
+    PrefixIndex of router numbers answers the lookups instead.
+    """
+    def __init__(self, routers):
+        self.routers = list(routers)
+        slashes = [routers[router_ip]["netmask"] for router_ip in self.routers]
+
+        if np is None:
+            self.index = PrefixIndex()
+            for number, (router_ip, slash) in enumerate(zip(self.routers, slashes)):
+                self.index.add(router_ip, slash, number)
+            return
+
+        values = ipv4_values(self.routers)
+        lengths = np.asarray(prefix_lengths(slashes), dtype=np.int64)
+        self.levels = []
+        for length in sorted(set(lengths.tolist()), reverse=True):
+            mask = np.uint32(((1 << length) - 1) << (32 - length))
+            numbers = np.flatnonzero(lengths == length)
+            # unique() keeps the first router of each network
+            networks, first = np.unique(values[numbers] & mask, return_index=True)
+            self.levels.append((mask, networks, numbers[first]))
+
+    def owners(self, ips):
+        """
+        The number of the router owning each address (dots-and-numbers, or
+        values from ipv4_values()), -1 where there is none. A NumPy int64
+        array with NumPy, otherwise a list.
+        """
+        if np is None:
+            found = self.index.lookup_many(ips)
+            return [-1 if number is None else number for number in found]
+
+        values = ipv4_values(ips)
+        owners = np.full(len(values), -1, dtype=np.int64)
+        for mask, networks, numbers in self.levels:
+            open_rows = np.flatnonzero(owners < 0)
+            if len(open_rows) == 0:
+                break
+            masked = values[open_rows] & mask
+            positions = np.searchsorted(networks, masked)
+            positions[positions == len(networks)] = 0
+            hit = networks[positions] == masked
+            owners[open_rows[hit]] = numbers[positions[hit]]
+        return owners
+
+    def owner_ips(self, ips):
+        """
+        owners() as router IPs, None where there is no router
+        """
+        return [None if number < 0 else self.routers[number]
+                for number in list(self.owners(ips))]
+
+def classify_pairs(table, src_ips, dest_ips, slashes):
+    """
+    Classifies many (source, destination) pairs in one pass. Returns the
+    same_subnets() flags and the owning router numbers of the sources and
+    the destinations from a NetworkTable. Each address column is parsed
+    only once.
+    """
+    src_values = ipv4_values(src_ips)
+    dest_values = ipv4_values(dest_ips)
+    return (same_subnets(src_values, dest_values, slashes),
+            table.owners(src_values), table.owners(dest_values))
+
 # Uncomment this code to have it run instead of the real main.
 # Be sure to comment it back out before you submit!
 
@@ -233,10 +520,7 @@ def usage():
     print("usage: netfuncs.py infile.json", file=sys.stderr)
 
 def read_routers(file_name):
-    with open(file_name) as fp:
-        json_data = fp.read()
-        
-    return json.loads(json_data)
+    return topostream.read_topology(file_name)
 
 def print_routers(routers):
     print("Routers:")
@@ -262,11 +546,13 @@ def print_same_subnets(src_dest_pairs):
     print("IP Pairs:")
 
     src_dest_pairs_list = sorted(src_dest_pairs)
+    same = same_subnets([src for src, _ in src_dest_pairs_list],
+                        [dest for _, dest in src_dest_pairs_list], "/24")
 
-    for src_ip, dest_ip in src_dest_pairs_list:
+    for (src_ip, dest_ip), same_subnet in zip(src_dest_pairs_list, same):
         print(f" {src_ip:>15s} {dest_ip:>15s}: ", end="")
 
-        if ips_same_subnet(src_ip, dest_ip, "/24"):
+        if same_subnet:
             print("same subnet")
         else:
             print("different subnets")
@@ -277,9 +563,10 @@ def print_ip_routers(routers, src_dest_pairs):
     all_ips = sorted(set([i for pair in src_dest_pairs for i in pair]))
 
     router_host_map = {}
+    prefix_index = PrefixIndex.from_routers(routers)
 
-    for ip in all_ips:
-        router = str(find_router_for_ip(routers, ip))
+    for ip, router in zip(all_ips, prefix_index.lookup_many(all_ips)):
+        router = str(router)
         
         if router not in router_host_map:
             router_host_map[router] = []
@@ -0,0 +1,438 @@
+'''
+A compact, integer-indexed form of the routers dictionary.
+
+Every router gets an index 0..V-1 (in the dictionary's order). Its links
+are stored in compressed sparse row (CSR) form: the links of router i are
+entries offsets[i] up to offsets[i+1] of the neighbors, weights and
+interface_ids arrays. Interface names are kept once each in
+interface_names.
+
+The arrays hold plain machine integers instead of nested dicts of
+dotted-quad strings, so a large topology takes a fraction of the memory
+and the shortest path loops never hash a string.
+'''
+
+import os
+import sys
+import json
+import math
+import heapq
+from array import array
+from collections import OrderedDict
+import netfuncs
+import topostream
+
+SNAPSHOT_MAGIC = b"ROUTERGRAPH 1\n"
+# RouterGraph arrays in the order they are stored in a snapshot
+SNAPSHOT_ARRAYS = ("offsets", "neighbors", "weights", "interface_ids", "networks", "masks")
+
+class RouterGraph:
+    def __init__(self, ips, offsets, neighbors, weights, interface_ids,
+                 interface_names, networks, masks, prefixes):
+        self.ips = ips
+        self.index = {ip: i for i, ip in enumerate(ips)}
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights
+        self.interface_ids = interface_ids
+        self.interface_names = interface_names
+        self.networks = networks
+        self.masks = masks
+        self.prefixes = prefixes
+
+    def __len__(self):
+        return len(self.ips)
+
+    def links(self, node):
+        '''
+        Yields (neighbor, weight) for each link out of router index node
+        '''
+        for k in range(self.offsets[node], self.offsets[node + 1]):
+            yield self.neighbors[k], self.weights[k]
+
+    def interface(self, node, neighbor):
+        '''
+        Name of the interface node uses to reach neighbor, or None if they
+        aren't linked
+        '''
+        for k in range(self.offsets[node], self.offsets[node + 1]):
+            if self.neighbors[k] == neighbor:
+                return self.interface_names[self.interface_ids[k]]
+        return None
+
+    def find_router(self, ip):
+        '''
+        Index of the router on the most specific subnet containing ip, or
+        -1 if there isn't one
+        '''
+        router = self.prefixes.lookup(ip)
+        return -1 if router is None else router
+
+class GraphBuilder:
+    '''
+    Builds a RouterGraph one router at a time, so a topology can be
+    compiled while it is still being read. A router's links may name
+    neighbors whose own entries come later: links are recorded against
+    provisional ids for every IP seen, which finish() maps to router
+    indices once all the routers are known.
+    '''
+    def __init__(self):
+        self.ips = []
+        # IP -> provisional id, for routers and neighbors alike
+        self.ids = {}
+        # provisional id -> router index, -1 until the router's entry is seen
+        self.router_ids = array('l')
+        self.offsets = array('l', [0])
+        self.neighbors = array('l')
+        self.weights = array('l')
+        self.interface_ids = array('l')
+        self.interface_names = []
+        self.interface_index = {}
+        self.networks = array('L')
+        self.masks = array('L')
+        self.prefixes = netfuncs.PrefixIndex()
+
+    def provisional_id(self, ip):
+        provisional = self.ids.get(ip)
+        if provisional is None:
+            provisional = self.ids[ip] = len(self.router_ids)
+            self.router_ids.append(-1)
+        return provisional
+
+    def add_router(self, ip, router):
+        provisional = self.provisional_id(ip)
+        if self.router_ids[provisional] >= 0:
+            raise ValueError(f"router {ip} is listed twice")
+        node = len(self.ips)
+        self.router_ids[provisional] = node
+        self.ips.append(ip)
+
+        mask = netfuncs.get_subnet_mask_value(router["netmask"])
+        network = netfuncs.ipv4_to_value(ip) & mask
+        self.masks.append(mask)
+        self.networks.append(network)
+        self.prefixes.add_network(network, prefix_length(mask), node)
+
+        for neighbor, connection in router["connections"].items():
+            ad = connection["ad"]
+            if not isinstance(ad, int) and self.weights.typecode != 'd':
+                # Administrative distances are normally integers, anything
+                # else switches the weights over to doubles
+                self.weights = array('d', self.weights)
+            name = connection.get("interface")
+            if name not in self.interface_index:
+                self.interface_index[name] = len(self.interface_names)
+                self.interface_names.append(name)
+            self.neighbors.append(self.provisional_id(neighbor))
+            self.weights.append(ad)
+            self.interface_ids.append(self.interface_index[name])
+        self.offsets.append(len(self.neighbors))
+
+    def finish(self):
+        '''
+        Returns the RouterGraph. Links to addresses that never showed up as
+        routers themselves are dropped, since no path can go through them.
+        '''
+        router_ids = self.router_ids
+        if min(router_ids, default=0) >= 0:
+            neighbors = array('l', map(router_ids.__getitem__, self.neighbors))
+            offsets, weights, interface_ids = self.offsets, self.weights, self.interface_ids
+        else:
+            offsets = array('l', [0])
+            neighbors = array('l')
+            weights = array(self.weights.typecode)
+            interface_ids = array('l')
+            for node in range(len(self.ips)):
+                for k in range(self.offsets[node], self.offsets[node + 1]):
+                    neighbor = router_ids[self.neighbors[k]]
+                    if neighbor >= 0:
+                        neighbors.append(neighbor)
+                        weights.append(self.weights[k])
+                        interface_ids.append(self.interface_ids[k])
+                offsets.append(len(neighbors))
+        return RouterGraph(self.ips, offsets, neighbors, weights, interface_ids,
+                           self.interface_names, self.networks, self.masks,
+                           self.prefixes)
+
+def compile_routers(routers):
+    '''
+    Builds a RouterGraph from the routers dictionary
+    '''
+    builder = GraphBuilder()
+    for ip, router in routers.items():
+        builder.add_router(ip, router)
+    return builder.finish()
+
+def load_topology(file_name, snapshot=None):
+    '''
+    Returns (graph, src_dest_pairs) for a topology JSON file. The file is
+    streamed through topostream and compiled router by router, so neither
+    its text nor its routers dictionary is ever held whole.
+
+    If snapshot names a file, the graph is loaded from it instead when it
+    was saved from the same version of the JSON file, and saved to it
+    otherwise.
+    '''
+    if snapshot is not None:
+        loaded = load_snapshot(snapshot, file_name)
+        if loaded is not None:
+            return loaded
+
+    builder = GraphBuilder()
+    src_dest_pairs = []
+    with open(file_name) as fp:
+        for item in topostream.iter_topology(fp):
+            if item[0] == "router":
+                builder.add_router(item[1], item[2])
+            else:
+                src_dest_pairs.append(item[1])
+    graph = builder.finish()
+
+    if snapshot is not None:
+        save_snapshot(graph, src_dest_pairs, snapshot, file_name)
+    return graph, src_dest_pairs
+
+def source_version(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def save_snapshot(graph, src_dest_pairs, snapshot, file_name):
+    '''
+    Writes the graph's arrays in binary after a one line JSON header, then
+    the IP and interface strings and the pairs as one more JSON line. The
+    file is written aside and renamed into place.
+    '''
+    header = {
+        "source": source_version(file_name),
+        "byteorder": sys.byteorder,
+        "arrays": [[name, getattr(graph, name).typecode, getattr(graph, name).itemsize,
+                    len(getattr(graph, name))] for name in SNAPSHOT_ARRAYS],
+    }
+    strings = {
+        "ips": graph.ips,
+        "interfaces": graph.interface_names,
+        "src-dest": src_dest_pairs,
+    }
+    temporary = snapshot + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(json.dumps(header).encode() + b"\n")
+        for name in SNAPSHOT_ARRAYS:
+            getattr(graph, name).tofile(f)
+        f.write(json.dumps(strings, separators=(",", ":")).encode())
+    os.replace(temporary, snapshot)
+
+def load_snapshot(snapshot, file_name):
+    '''
+    Returns (graph, src_dest_pairs) from a snapshot, or None if there isn't
+    one, or it is out of date, damaged or was written on a machine with
+    different array sizes or byte order. The snapshot is only a cache, so
+    in every one of those cases the JSON is read again.
+    '''
+    try:
+        f = open(snapshot, "rb")
+    except OSError:
+        return None
+    try:
+        with f:
+            return read_snapshot(f, file_name)
+    except (ValueError, KeyError, TypeError, IndexError, EOFError, OSError):
+        return None
+
+def read_snapshot(f, file_name):
+    '''
+    load_snapshot() for an open file. Raises one of the exceptions
+    load_snapshot() catches if it is damaged.
+    '''
+    if f.readline() != SNAPSHOT_MAGIC:
+        return None
+    header = json.loads(f.readline())
+    if header["source"] != source_version(file_name) or header["byteorder"] != sys.byteorder:
+        return None
+
+    arrays = {}
+    for name, typecode, itemsize, length in header["arrays"]:
+        values = array(typecode)
+        if values.itemsize != itemsize:
+            return None
+        values.fromfile(f, length)
+        arrays[name] = values
+    strings = json.loads(f.read())
+
+    ips = strings["ips"]
+    offsets = arrays["offsets"]
+    if (len(offsets) != len(ips) + 1 or offsets[-1] != len(arrays["neighbors"])
+            or len({len(arrays[name]) for name in ("neighbors", "weights", "interface_ids")}) != 1
+            or len(arrays["networks"]) != len(ips) or len(arrays["masks"]) != len(ips)):
+        raise ValueError("snapshot arrays don't fit together")
+
+    prefixes = netfuncs.PrefixIndex()
+    for node, (network, mask) in enumerate(zip(arrays["networks"], arrays["masks"])):
+        prefixes.add_network(network, prefix_length(mask), node)
+    graph = RouterGraph(ips, offsets, arrays["neighbors"],
+                        arrays["weights"], arrays["interface_ids"], strings["interfaces"],
+                        arrays["networks"], arrays["masks"], prefixes)
+    return graph, [tuple(pair) for pair in strings["src-dest"]]
+
+def shortest_path_tree(graph, source, target=-1):
+    '''
+    Heap-based Dijkstra over router indices from source. Stops early once
+    target is settled if one is given. Returns the distance and parent
+    lists, with math.inf and -1 for routers not reached.
+    '''
+    offsets = graph.offsets
+    neighbors = graph.neighbors
+    weights = graph.weights
+
+    distance = [math.inf] * len(graph)
+    parent = [-1] * len(graph)
+    visited = bytearray(len(graph))
+    distance[source] = 0
+    heap = [(0, source)]
+
+    while heap:
+        current_distance, current_node = heapq.heappop(heap)
+        if visited[current_node]:
+            continue
+        visited[current_node] = 1
+        if current_node == target:
+            break
+
+        for k in range(offsets[current_node], offsets[current_node + 1]):
+            neighbor = neighbors[k]
+            if visited[neighbor]:
+                continue
+            computed_distance = current_distance + weights[k]
+            if computed_distance < distance[neighbor]:
+                distance[neighbor] = computed_distance
+                parent[neighbor] = current_node
+                heapq.heappush(heap, (computed_distance, neighbor))
+
+    return distance, parent
+
+def first_hops(source, parent):
+    '''
+    For every router reached from source, the neighbor of source its
+    shortest path leaves through, or -1. Each parent chain is walked once
+    and every router on it is filled in on the way back.
+    '''
+    hop = array('l', [-1]) * len(parent)
+    for node in range(len(parent)):
+        if hop[node] >= 0 or parent[node] < 0:
+            continue
+        chain = []
+        while hop[node] < 0 and parent[node] != source:
+            chain.append(node)
+            node = parent[node]
+        first = node if hop[node] < 0 else hop[node]
+        hop[node] = first
+        for link in chain:
+            hop[link] = first
+    return hop
+
+def prefix_length(mask):
+    return bin(mask).count("1")
+
+def tree_path(graph, source, target, parent):
+    '''
+    Router IPs from source to target by following parent links back from
+    target. Empty if target wasn't reached.
+    '''
+    if target != source and parent[target] < 0:
+        return []
+    path = []
+    node = target
+    while node != source:
+        path.append(graph.ips[node])
+        node = parent[node]
+    path.append(graph.ips[source])
+    path.reverse()
+    return path
+
+class TreeCache:
+    '''
+    LRU cache of full shortest path trees over one graph, keyed by source
+    router index. A tree answers the path from its source to every other
+    router, so queries sharing a source only run Dijkstra once. Trees are
+    kept as arrays, about 16 bytes per router each.
+    '''
+    def __init__(self, graph, max_trees=32):
+        self.graph = graph
+        self.max_trees = max_trees
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def tree(self, source):
+        '''
+        Returns (distance, parent) for source, computing and caching it if
+        it isn't cached already
+        '''
+        tree = self.trees.get(source)
+        if tree is not None:
+            self.hits += 1
+            self.trees.move_to_end(source)
+            return tree
+        self.misses += 1
+        distance, parent = shortest_path_tree(self.graph, source)
+        tree = array('d', distance), array('l', parent)
+        self.trees[source] = tree
+        while len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return tree
+
+    def path(self, source, target):
+        _, parent = self.tree(source)
+        return tree_path(self.graph, source, target, parent)
+
+    def clear(self):
+        self.trees.clear()
+
+def shortest_path(graph, src_ip, dest_ip):
+    '''
+    dijkstras_shortest_path() on a compiled graph: the routers along the
+    shortest path between the routers serving src_ip and dest_ip
+    '''
+    first_router = graph.find_router(src_ip)
+    final_router = graph.find_router(dest_ip)
+    if first_router == final_router:
+        return []
+    if first_router < 0 or final_router < 0:
+        return []
+    distance, parent = shortest_path_tree(graph, first_router, final_router)
+    return tree_path(graph, first_router, final_router, parent)
+
+def cached_shortest_path(cache, src_ip, dest_ip):
+    '''
+    shortest_path() answered from the source router's cached tree
+    '''
+    first_router = cache.graph.find_router(src_ip)
+    final_router = cache.graph.find_router(dest_ip)
+    if first_router == final_router:
+        return []
+    if first_router < 0 or final_router < 0:
+        return []
+    return cache.path(first_router, final_router)
+
+def route_batch(cache, src_dest_pairs):
+    '''
+    Paths for every (src_ip, dest_ip) pair, in the order given. Pairs are
+    grouped by first router so each source's tree is used for all of its
+    destinations back to back, and computed at most once per batch however
+    small the cache is.
+    '''
+    graph = cache.graph
+    paths = [[] for _ in src_dest_pairs]
+    by_source = {}
+    for i, (src_ip, dest_ip) in enumerate(src_dest_pairs):
+        first_router = graph.find_router(src_ip)
+        final_router = graph.find_router(dest_ip)
+        if first_router == final_router or first_router < 0 or final_router < 0:
+            continue
+        by_source.setdefault(first_router, []).append((i, final_router))
+
+    for first_router, queries in by_source.items():
+        _, parent = cache.tree(first_router)
+        for i, final_router in queries:
+            paths[i] = tree_path(graph, first_router, final_router, parent)
+    return paths
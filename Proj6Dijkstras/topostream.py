@@ -0,0 +1,143 @@
+'''
+Reads topology JSON files incrementally.
+
+The file is read in chunks and only its outer structure is walked by
+hand: the top-level object, the "routers" object and the "src-dest"
+array. Each router and each pair is decoded on its own with the standard
+json decoder as soon as it is complete in the buffer, then dropped from
+it. The whole text of the file is never in memory, and neither is the
+whole routers dictionary unless the caller builds it.
+'''
+
+import json
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = " \t\n\r"
+
+class TopologyReader:
+    '''
+    A buffer over a text file that decodes one JSON value at a time
+    '''
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, wanted=None):
+        '''
+        Drops what has been consumed and reads more text. Returns False at
+        the end of the file.
+        '''
+        if self.eof:
+            return False
+        chunk = self.fp.read(max(wanted or 0, self.chunk_size))
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self):
+        '''
+        The next character that isn't whitespace, without consuming it, or
+        "" at the end of the file
+        '''
+        while True:
+            buffer = self.buffer
+            while self.pos < len(buffer) and buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(buffer):
+                return buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"expected one of {chars!r} at {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        '''
+        Decodes the next complete JSON value. A value running up to the end
+        of the buffer may be cut short (a number, say), so more is read and
+        it is decoded again.
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(len(self.buffer)):
+                    raise
+                continue
+            if end == len(self.buffer) and self.fill(len(self.buffer)):
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        '''
+        Walks an object, yielding each key with the reader positioned at
+        its value. The caller must consume the value before the next key.
+        '''
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def items(self):
+        '''
+        Decodes each value of an array in turn
+        '''
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+def iter_topology(fp, chunk_size=CHUNK_SIZE):
+    '''
+    Yields ("router", router_ip, router) for each router and
+    ("src-dest", (src_ip, dest_ip)) for each pair, in file order. Any
+    other top-level keys are decoded and skipped.
+    '''
+    reader = TopologyReader(fp, chunk_size)
+    for key in reader.members():
+        if key == "routers":
+            for router_ip in reader.members():
+                yield "router", router_ip, reader.value()
+        elif key == "src-dest":
+            for src_ip, dest_ip in reader.items():
+                yield "src-dest", (src_ip, dest_ip)
+        else:
+            reader.value()
+
+def read_topology(file_name):
+    '''
+    The same dictionary json.load() gives for a topology file, with only
+    "routers" and "src-dest" in it, built without reading the whole text
+    first
+    '''
+    routers = {}
+    src_dest = []
+    with open(file_name) as fp:
+        for item in iter_topology(fp):
+            if item[0] == "router":
+                routers[item[1]] = item[2]
+            else:
+                src_dest.append(list(item[1]))
+    return {"routers": routers, "src-dest": src_dest}